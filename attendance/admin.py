@@ -1,8 +1,25 @@
-from django.contrib import admin
-from .models import Attendance, Shift  
+from django.contrib import admin, messages
+from .forms import ShiftForm
+from .models import Attendance, Employee, PunchEvent, Shift  
+from .services import PunchService
+
+@admin.register(Employee)
+class EmployeeAdmin(admin.ModelAdmin):
+    list_display = ("code", "name", "name_kana", "hourly_rate", "is_active")
+    search_fields = ("code",)
+
+    def get_search_results(self, request, queryset, search_term):
+        # 正規化した索引列で前方一致（autocomplete_fields からも使われる）
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
 
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
+    autocomplete_fields = ["employee"]
+    # 出退勤時刻は打刻イベントからの projection。修正は PunchEvent の修正依頼→承認で行う
+    readonly_fields = ["clock_in", "clock_out"]
+
     @admin.display(description="出勤")
     def clock_in(self, obj):
         for name in ("clock_in", "start", "start_time", "in_time", "time_in"):
@@ -34,8 +51,52 @@ class AttendanceAdmin(admin.ModelAdmin):
                 pass
         return None
 
+@admin.register(PunchEvent)
+class PunchEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "work_date", "employee", "kind", "at", "note", "created_at")
+    list_filter = ("kind", "work_date")
+    autocomplete_fields = ["employee"]
+    actions = ["approve", "reject"]
+
+    # 追記専用: 画面からの追加・変更・削除はさせない（打刻と修正依頼は PunchService 経由のみ）
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def _review(self, request, queryset, approve):
+        done = 0
+        for ev in queryset:
+            try:
+                PunchService.review_correction(ev, approve)
+                done += 1
+            except ValueError as e:
+                self.message_user(request, f"{ev}: {e}", messages.WARNING)
+        self.message_user(request, f"{done} 件を処理しました。")
+
+    @admin.action(description="修正依頼を承認して反映")
+    def approve(self, request, queryset):
+        self._review(request, queryset, True)
+
+    @admin.action(description="修正依頼を却下")
+    def reject(self, request, queryset):
+        self._review(request, queryset, False)
+
+class ShiftAdminForm(ShiftForm):
+    # 重複・休息不足のチェックは ShiftForm.clean をそのまま使う。ウィジェットは admin 標準（autocomplete）に任せる
+    class Meta(ShiftForm.Meta):
+        widgets = {}
+
+
 @admin.register(Shift)
 class ShiftAdmin(admin.ModelAdmin):
+    form = ShiftAdminForm
+    autocomplete_fields = ["employee"]
+
     @admin.display(description="開始")
     def start(self, obj):
         for name in ("start", "start_time", "begin"):
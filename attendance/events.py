@@ -0,0 +1,138 @@
+"""
+打刻イベントのプロセス内 pub/sub。
+
+- 同じプロセスでの打刻は PunchService から即時 publish される
+- 他プロセス（gunicorn の別ワーカー等）での打刻は、1プロセスにつき1本の
+  ポーリングスレッドが DB をまとめて見に行って拾う
+購読者（SSE の接続）が何本あってもポーリングのクエリは1本で済む。
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.formats import date_format
+
+from .models import Attendance
+
+logger = logging.getLogger(__name__)
+
+
+def _fmt(dt):
+    # テンプレートの {{ a.clock_in }} と同じ表示にそろえる
+    return date_format(timezone.localtime(dt), "DATETIME_FORMAT") if dt else None
+
+
+def attendance_event(att, action: str) -> dict:
+    at = att.clock_in if action == "in" else att.clock_out
+    return {
+        "id": att.pk,
+        "action": action,
+        "work_date": date_format(att.work_date, "DATE_FORMAT"),
+        "employee_code": att.employee.code,
+        "employee_name": att.employee.name,
+        "clock_in": _fmt(att.clock_in),
+        "clock_out": _fmt(att.clock_out),
+        "at": at.isoformat() if at else None,
+    }
+
+
+class PunchBroker:
+    # コミット遅れで取りこぼさないよう、前回のポーリング時刻から少し遡って取り直す
+    OVERLAP = timedelta(seconds=10)
+
+    def __init__(self, poll_seconds=None, max_clients=None):
+        self.poll_seconds = poll_seconds or settings.PUNCH_STREAM_POLL_SECONDS
+        # SSE 接続は1本ごとにスレッドを占有するので、通常リクエスト用のスレッドを残すための上限
+        self.max_clients = max_clients or settings.PUNCH_STREAM_MAX_CLIENTS
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._seen = {}  # (attendance_id, action) -> 打刻時刻
+        self._thread = None
+
+    def has_capacity(self) -> bool:
+        with self._lock:
+            return len(self._subscribers) < self.max_clients
+
+    def subscribe(self):
+        """購読用のキューを返す。上限に達していれば None"""
+        q = queue.Queue(maxsize=100)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            self._subscribers.add(q)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._poll_loop, name="punch-broker", daemon=True)
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event: dict) -> None:
+        key = (event["id"], event["action"])
+        now = timezone.now()
+        with self._lock:
+            if not self._subscribers:
+                return  # 誰も見ていなければ記録もしない
+            if key in self._seen:
+                return
+            self._prune(now)
+            self._seen[key] = now
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass  # 読まれていない接続の分は捨てる
+
+    def _poll_loop(self):
+        since = timezone.now()
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            started = timezone.now()
+            try:
+                self.poll(since)
+            except Exception:
+                # ロック待ち等で1回失敗しても止めない。since を進めないので次回に取り直す
+                logger.warning("打刻のポーリングに失敗しました", exc_info=True)
+            else:
+                since = started
+            finally:
+                close_old_connections()
+            time.sleep(self.poll_seconds)
+
+    def poll(self, since) -> None:
+        cutoff = since - self.OVERLAP
+        qs = (
+            Attendance.objects.select_related("employee")
+            .filter(work_date__gte=timezone.localdate(cutoff) - timedelta(days=1))
+            .filter(Q(clock_in__gt=cutoff) | Q(clock_out__gt=cutoff))
+        )
+        events = []
+        for att in qs:
+            if att.clock_in and att.clock_in > cutoff:
+                events.append(attendance_event(att, "in"))
+            if att.clock_out and att.clock_out > cutoff:
+                events.append(attendance_event(att, "out"))
+        for ev in sorted(events, key=lambda e: e["at"]):
+            self.publish(ev)
+        with self._lock:
+            self._prune(timezone.now())
+
+    def _prune(self, now) -> None:
+        # ポーリングで重複して読み直す範囲（OVERLAP + 間隔）より古いものは不要
+        horizon = now - 2 * self.OVERLAP - timedelta(seconds=self.poll_seconds)
+        self._seen = {k: v for k, v in self._seen.items() if v > horizon}
+
+
+broker = PunchBroker()
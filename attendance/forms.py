@@ -1,5 +1,18 @@
 from django import forms
-from .models import Employee, Shift
+from django.urls import reverse
+from .models import Employee, Shift, PunchEvent
+from .services import ShiftConflictDetector
+
+
+class EmployeeAutocompleteWidget(forms.Widget): #全従業員の<option>を出さず、入力に応じてAPIから候補を取得
+    template_name = "attendance/widgets/employee_autocomplete.html"
+
+    def get_context(self, name, value, attrs):
+        ctx = super().get_context(name, value, attrs)
+        emp = Employee.objects.filter(pk=value).first() if str(value or "").isdigit() else None
+        ctx["widget"]["label"] = emp.label if emp else ""
+        ctx["widget"]["url"] = reverse("attendance:employee_search_api")
+        return ctx
 
 class PunchForm(forms.Form): #出勤と退勤の画面
     employee_code = forms.CharField(
@@ -8,14 +21,30 @@ class PunchForm(forms.Form): #出勤と退勤の画面
         widget=forms.TextInput(attrs={"class": "input"})
     )
 
+class PunchCorrectionForm(forms.Form): #打刻の修正依頼（従業員本人）
+    employee_code = forms.CharField(
+        label="従業員コード",
+        max_length=20,
+        widget=forms.TextInput(attrs={"class": "input"})
+    )
+    work_date = forms.DateField(label="日付", widget=forms.DateInput(attrs={"type": "date", "class": "input"}))
+    kind = forms.ChoiceField(
+        label="修正する打刻",
+        choices=[(PunchEvent.FIX_IN, "出勤"), (PunchEvent.FIX_OUT, "退勤")],
+        widget=forms.RadioSelect,
+    )
+    time = forms.TimeField(label="正しい時刻", widget=forms.TimeInput(attrs={"type": "time", "class": "input"}))
+    note = forms.CharField(label="理由", max_length=255, required=False, widget=forms.TextInput(attrs={"class": "input"}))
+
 class EmployeeForm(forms.ModelForm):#従業員登録画面
     class Meta:
         model = Employee
-        fields = ["code", "name", "hourly_rate",]  
+        fields = ["code", "name", "name_kana", "hourly_rate",]  
         labels = {"hourly_rate": "時給（円）"}
         widgets = {
             "code": forms.TextInput(attrs={"class": "input"}),
             "name": forms.TextInput(attrs={"class": "input"}),
+            "name_kana": forms.TextInput(attrs={"class": "input"}),
             "hourly_rate": forms.NumberInput(attrs={"class": "input", "min": 0, "step": 1}),
         }
 
@@ -25,6 +54,7 @@ class ShiftForm(forms.ModelForm): #シフト登録画面
         model = Shift
         fields = ["employee", "date", "start", "end", "break_minutes", "note"]
         widgets = {
+            "employee": EmployeeAutocompleteWidget(),
             "date":  forms.DateInput(attrs={"type": "date", "class": "input"}),
             "start": forms.TimeInput(attrs={"type": "time", "class": "input", "step": 300}),
             "end":   forms.TimeInput(attrs={"type": "time", "class": "input", "step": 300}),
@@ -32,6 +62,18 @@ class ShiftForm(forms.ModelForm): #シフト登録画面
             "note":  forms.TextInput(attrs={"class": "input"}),
         }
 
+    def clean(self):
+        cleaned = super().clean()
+        if all(cleaned.get(k) for k in ("employee", "date", "start", "end")):
+            shift = Shift(
+                pk=self.instance.pk, employee=cleaned["employee"], date=cleaned["date"],
+                start=cleaned["start"], end=cleaned["end"],
+            )
+            conflicts = ShiftConflictDetector().check(shift)
+            if conflicts:
+                raise forms.ValidationError([c.message for c in conflicts])
+        return cleaned
+
 class BulkExcelUploadForm(forms.Form): #Excel一括登録画面
     employees_file = forms.FileField(label="従業員Excel (.xlsx)", required=False)   
     shifts_file = forms.FileField(label="シフトExcel (.xlsx)", required=False)
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.services import ShiftConflictDetector
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"日付の形式が不正です (YYYY-MM-DD): {value}")
+
+
+class Command(BaseCommand):
+    help = "シフトの重複・休息時間不足を期間全体で監査します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="開始日 (YYYY-MM-DD)")
+        parser.add_argument("--to", dest="date_to", help="終了日 (YYYY-MM-DD)")
+        parser.add_argument("--min-rest", type=int, default=None, help="最低休息時間（分）")
+
+    def handle(self, *args, **opts):
+        date_from = _parse_date(opts["date_from"]) if opts["date_from"] else None
+        date_to = _parse_date(opts["date_to"]) if opts["date_to"] else None
+
+        detector = ShiftConflictDetector(opts["min_rest"])
+        counts = {"overlap": 0, "rest": 0}
+        for c in detector.audit(date_from, date_to):
+            counts[c.kind] += 1
+            self.stdout.write(c.message)
+
+        summary = f"重複 {counts['overlap']} 件 / 休息不足 {counts['rest']} 件"
+        if any(counts.values()):
+            self.stdout.write(self.style.WARNING(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,268 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from io import BytesIO
+
+import pandas as pd
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from attendance.models import Attendance, DataVersion, Employee, PunchEvent, Shift, normalize_search
+
+PREFIX = "LOAD-"
+LOCK_WORDS = ("locked", "deadlock", "could not serialize", "lock timeout")
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_failures = defaultdict(int)
+        self.rejected = defaultdict(int)  # 302 で返ったが記録されていない（画面上のエラー表示）
+        self.no_csrf = 0  # 画面の取得に失敗し CSRF cookie が無いため送信しなかった回数
+
+    def record(self, op, fn, check=None):
+        """fn を計測する。check は計測外で呼び、False ならアプリ側で拒否されたとみなす"""
+        t0 = time.perf_counter()
+        try:
+            resp = fn()
+            failed = resp.status_code >= 400
+            locked = False
+        except OperationalError as e:
+            resp = None
+            failed = True
+            locked = any(w in str(e).lower() for w in LOCK_WORDS)
+        except Exception:
+            resp = None
+            failed, locked = True, False
+        elapsed = time.perf_counter() - t0
+        rejected = False
+        if not failed and check is not None:
+            try:
+                rejected = not check()
+            except OperationalError:
+                pass  # 確認用のクエリ自体がロックで失敗した場合は判定しない
+        with self._lock:
+            self.latencies[op].append(elapsed)
+            if locked:
+                self.lock_failures[op] += 1
+            elif failed:
+                self.errors[op] += 1
+            elif rejected:
+                self.rejected[op] += 1
+        return resp
+
+
+class ThreadClient(Client):
+    """
+    Client は got_request_exception を全インスタンスで受け取るため、並列に使うと
+    他スレッドのリクエストの例外を自分のものとして再送出してしまう。作成したスレッドの分だけ受け取る。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._owner = threading.get_ident()
+
+    def store_exc_info(self, **kwargs):
+        if threading.get_ident() == self._owner:
+            super().store_exc_info(**kwargs)
+
+
+def _pct(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[i]
+
+
+class Command(BaseCommand):
+    help = "打刻の集中（シフト交代時）をプロセス内で再現し、レイテンシ・エラー率・スループットを計測します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=20, help="打刻する並列スレッド数")
+        parser.add_argument("--iterations", type=int, default=20, help="1スレッドあたりの打刻回数（出勤+退勤）")
+        parser.add_argument("--import-workers", type=int, default=1, help="並行してシフトExcelを取り込むスレッド数")
+        parser.add_argument("--export-workers", type=int, default=1, help="並行してExcelを書き出すスレッド数")
+        parser.add_argument("--background-iterations", type=int, default=5, help="取込/書出スレッドの繰り返し回数")
+        parser.add_argument("--keep", action="store_true", help="計測用データを削除せずに残す")
+        parser.add_argument(
+            "--noinput", "--no-input", action="store_false", dest="interactive",
+            help="確認せずに実行する（CI など）",
+        )
+
+    def handle(self, *args, **opts):
+        workers, iterations = opts["workers"], opts["iterations"]
+        if opts["interactive"] and not self.confirm():
+            raise CommandError("中止しました。")
+        self.cleanup()
+        emps = self.setup_employees(workers * iterations)
+        stats = Stats()
+
+        # 失敗は集計するので、リクエストごとのトレースバック出力は抑える
+        req_logger = logging.getLogger("django.request")
+        level = req_logger.level
+        req_logger.setLevel(logging.CRITICAL)
+        hosts = [*settings.ALLOWED_HOSTS, "testserver"]
+        with override_settings(ALLOWED_HOSTS=hosts):
+            threads = [
+                threading.Thread(target=self.punch_worker, args=(stats, emps[i::workers]))
+                for i in range(workers)
+            ]
+            threads += [
+                threading.Thread(target=self.import_worker, args=(stats, emps, opts["background_iterations"]))
+                for _ in range(opts["import_workers"])
+            ]
+            threads += [
+                threading.Thread(target=self.export_worker, args=(stats, opts["background_iterations"]))
+                for _ in range(opts["export_workers"])
+            ]
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - started
+        req_logger.setLevel(level)
+
+        self.report(stats, wall)
+        if not opts["keep"]:
+            self.cleanup()
+
+    # ---------- 準備・後片付け ----------
+    def confirm(self):
+        # DATABASE_URL が本番を指していると、本番に従業員・シフト・打刻を作って消すことになる
+        db = settings.DATABASES["default"]
+        self.stdout.write(self.style.WARNING(
+            f"接続先 {connection.vendor} ({db.get('HOST') or db['NAME']}) に {PREFIX}* の従業員・シフト・打刻を作成し、"
+            f"終了時に削除します（既存の {PREFIX}* も削除されます）。"
+        ))
+        return input("続けるには yes と入力してください: ").strip().lower() == "yes"
+
+    def setup_employees(self, n):
+        rows = []
+        for i in range(n):
+            code = f"{PREFIX}{i:06d}"
+            name = f"負荷試験{i}"
+            rows.append(Employee(
+                code=code, name=name, code_key=normalize_search(code), kana_key=normalize_search(name)
+            ))
+        Employee.objects.bulk_create(rows, batch_size=500)
+        DataVersion.bump("employee")  # bulk_create は signal を送らない
+        return list(Employee.objects.filter(code__startswith=PREFIX).values_list("code", flat=True))
+
+    def cleanup(self):
+        with transaction.atomic():
+            emps = Employee.objects.filter(code__startswith=PREFIX)
+            Attendance.objects.filter(employee__in=emps).delete()
+            PunchEvent.objects.filter(employee__in=emps).delete()
+            Shift.objects.filter(employee__in=emps).delete()
+            emps.delete()
+
+    # ---------- ワーカー ----------
+    def _client(self):
+        # 本番と同じく CSRF を検証させる。SECURE_SSL_REDIRECT に備えて https で送る
+        return ThreadClient(enforce_csrf_checks=True, headers={"origin": "https://testserver"})
+
+    def _csrf(self, client):
+        cookie = client.cookies.get(settings.CSRF_COOKIE_NAME)
+        return cookie.value if cookie else ""
+
+    def _ensure_csrf(self, stats, client, op, url, retries=3):
+        """画面の取得がロック等で失敗すると CSRF cookie が付かないので、取り直す"""
+        for _ in range(retries):
+            if self._csrf(client):
+                return True
+            stats.record(op, lambda: client.get(url, secure=True))
+        if self._csrf(client):
+            return True
+        with stats._lock:
+            stats.no_csrf += 1
+        return False
+
+    def punch_worker(self, stats, codes):
+        client = self._client()
+        url = reverse("attendance:punch")
+        field = {"in": "clock_in", "out": "clock_out"}
+        try:
+            for code in codes:
+                stats.record("punch_page", lambda: client.get(url, secure=True))
+                if not self._ensure_csrf(stats, client, "punch_page", url):
+                    continue
+                for action in ("in", "out"):
+                    data = {"employee_code": code, action: "1", "csrfmiddlewaretoken": self._csrf(client)}
+                    # punch_view は ValueError でも 302 を返すので、実際に記録されたかを確認する
+                    recorded = lambda: Attendance.objects.filter(
+                        employee__code=code, work_date=timezone.localdate(),
+                        **{f"{field[action]}__isnull": False},
+                    ).exists()
+                    stats.record(f"punch_{action}", lambda: client.post(url, data, secure=True), recorded)
+        finally:
+            connection.close()
+
+    def import_worker(self, stats, codes, iterations):
+        client = self._client()
+        url = reverse("attendance:import_bulk")
+        day = timezone.localdate() + timedelta(days=30)
+        df = pd.DataFrame([
+            {"date": day.isoformat(), "employee_code": c, "start": "09:00", "end": "17:00", "break_minutes": 60}
+            for c in codes
+        ])
+        bio = BytesIO()
+        df.to_excel(bio, index=False)
+        payload = bio.getvalue()
+        # import_bulk_view もエラー時は 302 + メッセージなので、全行が入っているかで判定する
+        imported = lambda: Shift.objects.filter(
+            employee__code__in=codes, date=day, start="09:00", end="17:00"
+        ).count() == len(codes)
+        try:
+            if not self._ensure_csrf(stats, client, "import_page", url):
+                return
+            for _ in range(iterations):
+                upload = SimpleUploadedFile("shifts.xlsx", payload)
+                data = {"shifts_file": upload, "csrfmiddlewaretoken": self._csrf(client)}
+                stats.record("import_shifts", lambda: client.post(url, data, secure=True), imported)
+        finally:
+            connection.close()
+
+    def export_worker(self, stats, iterations):
+        client = self._client()
+        urls = {
+            "export_shifts": reverse("attendance:export_shifts"),
+            "export_employees": reverse("attendance:export_employees"),
+        }
+        try:
+            for _ in range(iterations):
+                for op, url in urls.items():
+                    stats.record(op, lambda: client.get(url, secure=True))
+        finally:
+            connection.close()
+
+    # ---------- 結果 ----------
+    def report(self, stats, wall):
+        self.stdout.write(f"DB: {connection.vendor} ({settings.DATABASES['default']['NAME']})  経過: {wall:.2f}s")
+        header = f"{'op':<18}{'n':>6}{'err%':>7}{'lock%':>7}{'rej%':>7}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}{'rps':>8}"
+        self.stdout.write(header)
+        total = 0
+        for op in sorted(stats.latencies):
+            vals = sorted(stats.latencies[op])
+            n = len(vals)
+            total += n
+            self.stdout.write(
+                f"{op:<18}{n:>6}"
+                f"{100 * stats.errors[op] / n:>7.1f}{100 * stats.lock_failures[op] / n:>7.1f}"
+                f"{100 * stats.rejected[op] / n:>7.1f}"
+                f"{_pct(vals, 50) * 1000:>9.1f}{_pct(vals, 95) * 1000:>9.1f}"
+                f"{_pct(vals, 99) * 1000:>9.1f}{vals[-1] * 1000:>9.1f}{n / wall:>8.1f}"
+            )
+        if stats.no_csrf:
+            self.stdout.write(self.style.WARNING(f"画面を取得できず送信しなかった回数: {stats.no_csrf}"))
+        self.stdout.write(self.style.SUCCESS(f"合計 {total} リクエスト / {total / wall:.1f} rps"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from attendance.management.commands.audit_shift_conflicts import _parse_date
+from attendance.services import AttendanceProjection
+
+
+class Command(BaseCommand):
+    help = "打刻イベントのログから指定期間の出退勤（Attendance）を再構築します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", required=True, help="開始日 (YYYY-MM-DD)")
+        parser.add_argument("--to", dest="date_to", required=True, help="終了日 (YYYY-MM-DD)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **opts):
+        date_from = _parse_date(opts["date_from"])
+        date_to = _parse_date(opts["date_to"])
+        r = AttendanceProjection.rebuild(date_from, date_to, batch_size=opts["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"追加 {r['created']} / 更新 {r['updated']} / 変更なし {r['unchanged']}"
+        ))
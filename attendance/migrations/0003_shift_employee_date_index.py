@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_alter_employee_hourly_rate'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='attendance',
+            options={'ordering': ['-work_date', 'employee__code']},
+        ),
+        migrations.AlterModelOptions(
+            name='employee',
+            options={'ordering': ['code']},
+        ),
+        migrations.AddIndex(
+            model_name='shift',
+            index=models.Index(fields=['employee', 'date', 'start'], name='attendance__employe_bb7bc6_idx'),
+        ),
+    ]
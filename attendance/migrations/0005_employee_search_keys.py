@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:23
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize_search(text):
+    # attendance.models.normalize_search の当時の実装（後から変わっても影響しないよう複製）
+    s = unicodedata.normalize("NFKC", text or "").strip().lower()
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in s)
+
+
+def fill_search_keys(apps, schema_editor):
+    Employee = apps.get_model("attendance", "Employee")
+    rows = list(Employee.objects.only("id", "code", "name", "name_kana"))
+    for e in rows:
+        e.code_key = normalize_search(e.code)
+        e.kana_key = normalize_search(e.name_kana or e.name)
+    Employee.objects.bulk_update(rows, ["code_key", "kana_key"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_attendance_updated_at_shift_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='code_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='kana_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='employee',
+            name='name_kana',
+            field=models.CharField(blank=True, max_length=100, verbose_name='よみがな'),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_events(apps, schema_editor):
+    # 既存の打刻をイベントとして取り込み、ログから Attendance を再構築できるようにする
+    Attendance = apps.get_model("attendance", "Attendance")
+    PunchEvent = apps.get_model("attendance", "PunchEvent")
+    batch = []
+    for a in Attendance.objects.order_by("work_date", "employee_id").iterator(chunk_size=2000):
+        if a.clock_in:
+            batch.append(PunchEvent(employee_id=a.employee_id, work_date=a.work_date, kind="in", at=a.clock_in))
+        if a.clock_out:
+            batch.append(PunchEvent(employee_id=a.employee_id, work_date=a.work_date, kind="out", at=a.clock_out))
+        if len(batch) >= 2000:
+            PunchEvent.objects.bulk_create(batch)
+            batch = []
+    PunchEvent.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0006_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PunchEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('work_date', models.DateField()),
+                ('kind', models.CharField(choices=[('in', '出勤'), ('out', '退勤'), ('fix_in', '出勤の修正依頼'), ('fix_out', '退勤の修正依頼'), ('approve', '承認'), ('reject', '却下')], max_length=10)),
+                ('at', models.DateTimeField(blank=True, null=True)),
+                ('note', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='punch_events', to='attendance.employee')),
+                ('ref', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='attendance.punchevent')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['work_date'], name='attendance__work_da_0b373d_idx'), models.Index(fields=['employee', 'work_date'], name='attendance__employe_a92f3a_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_events, migrations.RunPython.noop),
+    ]
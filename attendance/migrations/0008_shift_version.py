@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_punchevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shift',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:36
+
+import attendance.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_shift_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='token',
+            field=models.CharField(default=attendance.models._new_token, max_length=32),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import unicodedata
+import uuid
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -7,24 +9,59 @@ from django.db import models
 from django.utils import timezone
 
 
+def normalize_search(text: str) -> str:
+    """検索用の正規化: 全角/半角をそろえ、小文字化し、カタカナをひらがなにする"""
+    s = unicodedata.normalize("NFKC", text or "").strip().lower()
+    return "".join(chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c for c in s)
+
+
+class EmployeeQuerySet(models.QuerySet):
+    def search(self, term: str):
+        """コード・よみがな（未登録なら氏名）の前方一致（正規化済みの索引列を使う）"""
+        key = normalize_search(term)
+        if not key:
+            return self.none()
+        # LIKE 'x%' は SQLite で索引を使えないので、正規化済みの値に対する範囲検索にする
+        upper = key + "\uffff"
+        return self.filter(
+            models.Q(code_key__gte=key, code_key__lt=upper)
+            | models.Q(kana_key__gte=key, kana_key__lt=upper)
+        )
+
+
 # =========================================
 # 従業員
 # =========================================
 class Employee(models.Model):
     code = models.CharField(max_length=20, unique=True)
     name = models.CharField(max_length=100)
+    name_kana = models.CharField("よみがな", max_length=100, blank=True)
     hourly_rate = models.PositiveIntegerField("時給(円)", null=True, blank=True)
 
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # 検索用（save 時に自動更新）
+    code_key = models.CharField(max_length=20, db_index=True, editable=False, default="")
+    kana_key = models.CharField(max_length=100, db_index=True, editable=False, default="")
+
+    objects = EmployeeQuerySet.as_manager()
+
     class Meta:
         ordering = ["code"]
 
     def __str__(self) -> str:
         return f"{self.code} {self.name}"
 
+    def save(self, *args, **kwargs):
+        self.code_key = normalize_search(self.code)
+        self.kana_key = normalize_search(self.name_kana or self.name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "code_key", "kana_key"}
+        super().save(*args, **kwargs)
+
     @property
     def label(self) -> str:
         """プルダウン等で使いやすい表示"""
@@ -43,6 +80,7 @@ class Attendance(models.Model):
     clock_in = models.DateTimeField(null=True, blank=True)
     clock_out = models.DateTimeField(null=True, blank=True)
     note = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
@@ -77,6 +115,50 @@ class Attendance(models.Model):
         return f"{h}:{mm:02d}"
 
 
+# =========================================
+# 打刻イベント（追記のみ）
+#   - 打刻・修正依頼・承認/却下をすべて1行ずつ INSERT する
+#   - Attendance はこのログから組み立てた結果（projection）
+# =========================================
+class PunchEvent(models.Model):
+    IN = "in"
+    OUT = "out"
+    FIX_IN = "fix_in"
+    FIX_OUT = "fix_out"
+    APPROVE = "approve"
+    REJECT = "reject"
+    KIND_CHOICES = [
+        (IN, "出勤"),
+        (OUT, "退勤"),
+        (FIX_IN, "出勤の修正依頼"),
+        (FIX_OUT, "退勤の修正依頼"),
+        (APPROVE, "承認"),
+        (REJECT, "却下"),
+    ]
+
+    employee = models.ForeignKey(
+        Employee, on_delete=models.PROTECT, related_name="punch_events"
+    )
+    work_date = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    at = models.DateTimeField(null=True, blank=True)  # 打刻時刻 / 修正後の時刻
+    ref = models.ForeignKey(  # 承認・却下の対象となる修正依頼
+        "self", on_delete=models.CASCADE, null=True, blank=True, related_name="reviews"
+    )
+    note = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["work_date"]),
+            models.Index(fields=["employee", "work_date"]),
+        ]
+        ordering = ["id"]
+
+    def __str__(self) -> str:
+        return f"{self.work_date} {self.employee} {self.get_kind_display()}"
+
+
 # =========================================
 # シフト
 #   - date + start/end（Time）/ break_minutes（分）
@@ -91,14 +173,27 @@ class Shift(models.Model):
     end = models.TimeField()
     break_minutes = models.PositiveSmallIntegerField(default=0)
     note = models.CharField(max_length=255, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)  # 楽観ロック用（更新のたびに +1）
 
     class Meta:
-        indexes = [models.Index(fields=["date"])]
+        indexes = [
+            models.Index(fields=["date"]),
+            models.Index(fields=["employee", "date", "start"]),
+        ]
         ordering = ["date", "start"]
 
     def __str__(self) -> str:
         return f"{self.date} {self.employee} {self.start}-{self.end}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version = (self.version or 0) + 1
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "version"}
+        super().save(*args, **kwargs)
+
     # ---------- 内部ユーティリティ ----------
     def _start_dt(self) -> datetime:
         return datetime.combine(self.date, self.start)
@@ -131,3 +226,37 @@ class Shift(models.Model):
             return None
         per_min = rate / 60.0
         return int(round(per_min * self.total_work_minutes()))
+
+
+def _new_token() -> str:
+    return uuid.uuid4().hex
+
+
+# =========================================
+# データ版数（エクスポートキャッシュの無効化用）
+#   - Employee / Shift の保存・削除で +1（signals.py）
+# =========================================
+class DataVersion(models.Model):
+    key = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    # 更新のたびに振り直す乱数。DB の作り直しやバックアップからの復元で
+    # version が同じ値に戻っても、別の版として区別できる
+    token = models.CharField(max_length=32, default=_new_token)
+
+    def __str__(self) -> str:
+        return f"{self.key} v{self.version}"
+
+    @classmethod
+    def bump(cls, key: str) -> None:
+        if not cls.objects.filter(key=key).update(version=models.F("version") + 1, token=_new_token()):
+            cls.objects.get_or_create(key=key, defaults={"version": 1})
+
+    @classmethod
+    def current(cls, *keys: str) -> dict:
+        """{key: "token:version"}。まだ行が無いキーはここで作る"""
+        found = {k: f"{t}:{v}" for k, t, v in cls.objects.filter(key__in=keys).values_list("key", "token", "version")}
+        for k in keys:
+            if k not in found:
+                row, _ = cls.objects.get_or_create(key=k)
+                found[k] = f"{row.token}:{row.version}"
+        return found
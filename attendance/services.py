@@ -1,10 +1,29 @@
+import calendar
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from django import forms
+from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
-from django.http import HttpResponse
-from .models import Employee, Attendance, Shift
+from django.db import transaction, DatabaseError, IntegrityError
+from django.db.models import Count, F, Max
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, FileResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .models import Employee, Attendance, Shift, DataVersion, PunchEvent
+from .events import broker, attendance_event
 import pandas as pd
 from io import BytesIO
 
+logger = logging.getLogger(__name__)
+
 
 class PunchService:
     @staticmethod
@@ -15,26 +34,242 @@ class PunchService:
         return PunchService.punch(emp, action)
 
     @staticmethod
-    @transaction.atomic
     def punch(employee: Employee, action: str) -> str:
+        """
+        打刻の確定はイベントの INSERT 1件（自動コミット）で、当日の Attendance 行はロックしない。
+        Attendance（projection）はその後、同じリクエスト内の別の短いトランザクションで反映する
+        （打刻画面の一覧・カレンダーにすぐ出すため）。反映に失敗しても打刻は残る。
+        """
+        if action not in (PunchEvent.IN, PunchEvent.OUT):
+            raise ValueError("不正な操作です。")
         today = timezone.localdate()
         now = timezone.now()
-        att, _ = Attendance.objects.get_or_create(employee=employee, work_date=today)
-        if action == "in":
-            if att.clock_in:
+
+        # 判定もログの再生で行う。同時に2回押されても replay は最初の1件しか使わない
+        clock_in, clock_out = AttendanceProjection.replay(AttendanceProjection.events_for(employee.pk, today))
+        if action == PunchEvent.IN:
+            if clock_in:
                 raise ValueError("本日はすでに出勤済みです。")
-            att.clock_in = now
-            att.save(update_fields=["clock_in"])
-            return f"{employee.name} さん、出勤を記録しました。"
-        if action == "out":
-            if not att.clock_in:
+        else:
+            if not clock_in:
                 raise ValueError("本日は出勤が未記録です。")
-            if att.clock_out:
+            if clock_out:
                 raise ValueError("本日はすでに退勤済みです。")
-            att.clock_out = now
-            att.save(update_fields=["clock_out"])
-            return f"{employee.name} さん、退勤を記録しました。"
-        raise ValueError("不正な操作です。")
+        PunchEvent.objects.create(employee=employee, work_date=today, kind=action, at=now)
+
+        try:
+            att = AttendanceProjection.refresh(employee.pk, today)
+        except DatabaseError:
+            # 打刻自体は記録済み。projection は次の打刻か rebuild_attendance で追いつく
+            logger.warning("Attendance の反映に失敗しました: %s %s", employee.code, today, exc_info=True)
+        else:
+            att.employee = employee
+            transaction.on_commit(lambda: broker.publish(attendance_event(att, action)))
+        if action == PunchEvent.IN:
+            return f"{employee.name} さん、出勤を記録しました。"
+        return f"{employee.name} さん、退勤を記録しました。"
+
+    @staticmethod
+    def request_correction(code: str, work_date, kind: str, at_time, note: str = "") -> PunchEvent:
+        """従業員本人による打刻の修正依頼（店長の承認で反映）。at_time は時刻（time）"""
+        emp = Employee.objects.filter(code=code, is_active=True).first()
+        if not emp:
+            raise ValueError("従業員コードが見つかりません。")
+        if kind not in (PunchEvent.FIX_IN, PunchEvent.FIX_OUT):
+            raise ValueError("不正な操作です。")
+        clock_in, clock_out = AttendanceProjection.replay(AttendanceProjection.events_for(emp.pk, work_date))
+        at = timezone.make_aware(datetime.combine(work_date, at_time))
+        if kind == PunchEvent.FIX_OUT:
+            if clock_in and at <= clock_in:
+                at += timedelta(days=1)  # 跨日勤務: 出勤以前の時刻は翌日の退勤
+        elif clock_out and at >= clock_out:
+            raise ValueError("出勤時刻が退勤時刻より後になっています。")
+        return PunchEvent.objects.create(employee=emp, work_date=work_date, kind=kind, at=at, note=note)
+
+    @staticmethod
+    @transaction.atomic
+    def review_correction(request_event: PunchEvent, approve: bool) -> PunchEvent:
+        # 承認と却下が同時に走っても片方だけが通るよう、依頼の行をロックしてから確認する
+        request_event = PunchEvent.objects.select_for_update().get(pk=request_event.pk)
+        if request_event.kind not in (PunchEvent.FIX_IN, PunchEvent.FIX_OUT):
+            raise ValueError("修正依頼ではありません。")
+        if request_event.reviews.exists():
+            raise ValueError("この修正依頼は処理済みです。")
+        ev = PunchEvent.objects.create(
+            employee_id=request_event.employee_id,
+            work_date=request_event.work_date,
+            kind=PunchEvent.APPROVE if approve else PunchEvent.REJECT,
+            ref=request_event,
+        )
+        if approve:
+            clock_in, clock_out = AttendanceProjection.replay(
+                AttendanceProjection.events_for(request_event.employee_id, request_event.work_date)
+            )
+            if clock_in and clock_out and clock_out <= clock_in:
+                raise ValueError("退勤時刻が出勤時刻より前になるため反映できません。")
+            AttendanceProjection.refresh(request_event.employee_id, request_event.work_date)
+        return ev
+
+
+class AttendanceProjection:
+    """
+    PunchEvent のログを (従業員, 日付, id) 順に再生して Attendance を組み立てる。
+    打刻直後の反映も rebuild も同じ replay を使うので、結果は必ず一致する。
+    """
+
+    @staticmethod
+    def events_for(employee_id, work_date):
+        return PunchEvent.objects.filter(employee_id=employee_id, work_date=work_date).order_by("id")
+
+    @staticmethod
+    def replay(events):
+        # 出勤・退勤はそれぞれ最初の1件が有効（同時押しの重複は無視）。承認済みの修正で上書き
+        clock_in = clock_out = None
+        pending = {}
+        for ev in events:
+            if ev.kind == PunchEvent.IN:
+                clock_in = clock_in or ev.at
+            elif ev.kind == PunchEvent.OUT:
+                clock_out = clock_out or ev.at
+            elif ev.kind in (PunchEvent.FIX_IN, PunchEvent.FIX_OUT):
+                pending[ev.pk] = ev
+            elif ev.kind == PunchEvent.APPROVE:
+                fix = pending.pop(ev.ref_id, None)
+                if fix and fix.kind == PunchEvent.FIX_IN:
+                    clock_in = fix.at
+                elif fix:
+                    clock_out = fix.at
+            elif ev.kind == PunchEvent.REJECT:
+                pending.pop(ev.ref_id, None)
+        return clock_in, clock_out
+
+    @staticmethod
+    @transaction.atomic
+    def refresh(employee_id, work_date) -> Attendance:
+        """1人・1日分をログから反映する。行をロックしてから読むので、同時に走っても最後の結果が最新になる"""
+        rows = Attendance.objects.filter(employee_id=employee_id, work_date=work_date)
+        # 値を変えない UPDATE で先に書き込みロックを取る（PostgreSQL は行ロック）。
+        # SQLite は読み取り後の書き込みへの昇格がロック待ちせず即失敗するので、select_for_update では足りない
+        rows.update(clock_in=F("clock_in"))
+        att = rows.first()
+        clock_in, clock_out = AttendanceProjection.replay(AttendanceProjection.events_for(employee_id, work_date))
+        if att is None:
+            try:
+                with transaction.atomic():
+                    return Attendance.objects.create(
+                        employee_id=employee_id, work_date=work_date, clock_in=clock_in, clock_out=clock_out
+                    )
+            except IntegrityError:  # 同時に作られた
+                rows.update(clock_in=F("clock_in"))
+                att = rows.get()
+                clock_in, clock_out = AttendanceProjection.replay(
+                    AttendanceProjection.events_for(employee_id, work_date)
+                )
+        if (att.clock_in, att.clock_out) != (clock_in, clock_out):
+            att.clock_in, att.clock_out = clock_in, clock_out
+            att.save(update_fields=["clock_in", "clock_out", "updated_at"])
+        return att
+
+    @staticmethod
+    def rebuild(date_from, date_to, employee_id=None, batch_size=1000) -> dict:
+        """期間内の Attendance をログから作り直す（ソート済みでストリーム再生し、まとめて書き込む）"""
+        events = PunchEvent.objects.filter(work_date__range=(date_from, date_to)).only(
+            "id", "employee_id", "work_date", "kind", "at", "ref_id"
+        )
+        if employee_id is not None:
+            events = events.filter(employee_id=employee_id)
+        counts = {"created": 0, "updated": 0, "unchanged": 0}
+        batch = {}
+
+        def flush():
+            if not batch:
+                return
+            dates = [k[1] for k in batch]
+            existing = Attendance.objects.filter(
+                employee_id__in={k[0] for k in batch}, work_date__range=(min(dates), max(dates))
+            ).only("id", "employee_id", "work_date", "clock_in", "clock_out")
+            current = {(a.employee_id, a.work_date): a for a in existing}
+            now = timezone.now()
+            to_create, to_update = [], []
+            for key, (clock_in, clock_out) in batch.items():
+                att = current.get(key)
+                if att is None:
+                    if clock_in or clock_out:
+                        to_create.append(Attendance(
+                            employee_id=key[0], work_date=key[1], clock_in=clock_in, clock_out=clock_out
+                        ))
+                        counts["created"] += 1
+                elif (att.clock_in, att.clock_out) != (clock_in, clock_out):
+                    att.clock_in, att.clock_out, att.updated_at = clock_in, clock_out, now
+                    to_update.append(att)
+                    counts["updated"] += 1
+                else:
+                    counts["unchanged"] += 1
+            with transaction.atomic():
+                Attendance.objects.bulk_create(to_create)
+                Attendance.objects.bulk_update(to_update, ["clock_in", "clock_out", "updated_at"])
+            batch.clear()
+
+        ordered = events.order_by("employee_id", "work_date", "id").iterator(chunk_size=batch_size)
+        for key, group in groupby(ordered, key=lambda ev: (ev.employee_id, ev.work_date)):
+            batch[key] = AttendanceProjection.replay(group)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        return counts
+
+
+class EmployeeCalendar:
+    """1人分・1か月分のシフトと打刻（スマホ/キオスク向け JSON）"""
+
+    def __init__(self, employee: Employee, year: int, month: int):
+        self.employee = employee
+        self.first = date(year, month, 1)
+        self.last = date(year, month, calendar.monthrange(year, month)[1])
+
+    def shifts(self):
+        return Shift.objects.filter(employee=self.employee, date__range=(self.first, self.last))
+
+    def attendances(self):
+        return Attendance.objects.filter(employee=self.employee, work_date__range=(self.first, self.last))
+
+    def etag(self) -> str:
+        # 件数 + 最終更新時刻。削除は件数、追加・更新は updated_at で変わる
+        parts = [self.employee.pk, self.employee.updated_at.isoformat(), self.first.isoformat()]
+        for qs in (self.shifts(), self.attendances()):
+            agg = qs.order_by().aggregate(n=Count("id"), latest=Max("updated_at"))
+            parts += [agg["n"], agg["latest"].isoformat() if agg["latest"] else ""]
+        return hashlib.md5("|".join(map(str, parts)).encode()).hexdigest()
+
+    def as_dict(self) -> dict:
+        return {
+            "employee": {"code": self.employee.code, "name": self.employee.name},
+            "year": self.first.year,
+            "month": self.first.month,
+            "shifts": [
+                {
+                    "id": s.pk,
+                    "date": s.date.isoformat(),
+                    "start": s.start.strftime("%H:%M"),
+                    "end": s.end.strftime("%H:%M"),
+                    "break_minutes": s.break_minutes,
+                    "work_minutes": s.total_work_minutes(),
+                    "note": s.note,
+                }
+                for s in self.shifts().order_by("date", "start")
+            ],
+            "attendances": [
+                {
+                    "id": a.pk,
+                    "work_date": a.work_date.isoformat(),
+                    "clock_in": timezone.localtime(a.clock_in).isoformat() if a.clock_in else None,
+                    "clock_out": timezone.localtime(a.clock_out).isoformat() if a.clock_out else None,
+                    "duration_minutes": a.duration_minutes(),
+                    "note": a.note,
+                }
+                for a in self.attendances().order_by("work_date")
+            ],
+        }
 
 
 class EmployeeExcelImporter:
@@ -56,10 +291,16 @@ class EmployeeExcelImporter:
                 hourly_col = cand
                 break
 
+        kana_col = next((c for c in ("よみがな", "name_kana") if c in df.columns), None)
+
         created = updated = 0
         for _, r in df.iterrows():
             code = str(r["code"]).strip()
             name = str(r["name"]).strip()
+            defaults = {"name": name}
+            if kana_col is not None:
+                kana = r.get(kana_col)
+                defaults["name_kana"] = str(kana).strip() if pd.notna(kana) else ""
             hourly = None
             if hourly_col is not None:
                 val = r.get(hourly_col)
@@ -69,15 +310,94 @@ class EmployeeExcelImporter:
                     except Exception:
                         raise ValueError(f"時給の値が不正です: {val}")
 
-            obj, is_created = Employee.objects.update_or_create(
-                code=code,
-                defaults={"name": name, "hourly_rate": hourly}
-            )
+            defaults["hourly_rate"] = hourly
+            obj, is_created = Employee.objects.update_or_create(code=code, defaults=defaults)
             created += int(is_created)
             updated += int(not is_created)
         return {"created": created, "updated": updated}
 
 
+@dataclass(frozen=True)
+class ShiftConflict:
+    kind: str  # "overlap" | "rest"
+    shift: Shift  # 後から始まる側
+    other: Shift  # 先に始まる側
+    gap_minutes: int = 0
+
+    @property
+    def message(self) -> str:
+        if self.kind == "overlap":
+            return f"シフトが重複しています: {self.other} / {self.shift}"
+        return f"休息時間が不足しています（{self.gap_minutes}分）: {self.other} → {self.shift}"
+
+
+class ShiftConflictDetector:
+    """
+    従業員ごとにシフトを開始日時（跨日込み）でソートし、1回の走査で
+    重複と休息不足（別の日の勤務との間隔が min_rest 未満）を検出する。
+    """
+
+    def __init__(self, min_rest_minutes=None):
+        if min_rest_minutes is None:
+            min_rest_minutes = settings.SHIFT_MIN_REST_MINUTES
+        self.min_rest = timedelta(minutes=int(min_rest_minutes))
+
+    def sweep(self, shifts):
+        by_emp = defaultdict(list)
+        for s in shifts:
+            by_emp[s.employee_id].append(s)
+        conflicts = []
+        for items in by_emp.values():
+            conflicts.extend(self._sweep_one(items))
+        return conflicts
+
+    def _sweep_one(self, shifts):
+        # 同一従業員のシフト列。直前までで最も遅く終わるシフトとだけ比べれば足りる
+        items = sorted(((s._start_dt(), s._end_dt(), s) for s in shifts), key=lambda t: t[0])
+        conflicts = []
+        last_end = last = None
+        for start, end, s in items:
+            if last is not None:
+                if start < last_end:
+                    conflicts.append(ShiftConflict("overlap", s, last))
+                elif self.min_rest and s.date != last.date and start - last_end < self.min_rest:
+                    gap = int((start - last_end).total_seconds() // 60)
+                    conflicts.append(ShiftConflict("rest", s, last, gap))
+            if last is None or end > last_end:
+                last_end, last = end, s
+        return conflicts
+
+    def window(self, date_from, date_to):
+        """date_from〜date_to のシフトと衝突しうるシフトの日付範囲（跨日・休息時間ぶん広げる）"""
+        pad = timedelta(days=3 + self.min_rest.days)
+        return date_from - pad, date_to + pad
+
+    def check(self, shift):
+        """1件のシフト（未保存でも可）について、既存シフトとの衝突を返す"""
+        lo, hi = self.window(shift.date, shift.date)
+        others = Shift.objects.select_related("employee").filter(
+            employee_id=shift.employee_id, date__gte=lo, date__lte=hi
+        )
+        if shift.pk:
+            others = others.exclude(pk=shift.pk)
+        return [c for c in self._sweep_one([shift, *others]) if shift in (c.shift, c.other)]
+
+    def audit(self, date_from=None, date_to=None):
+        """全従業員の期間内シフトを DB でソート済みのままストリームして監査する"""
+        qs = Shift.objects.select_related("employee").only(
+            "id", "employee_id", "date", "start", "end", "employee__code", "employee__name"
+        )
+        if date_from:
+            qs = qs.filter(date__gte=self.window(date_from, date_from)[0])
+        if date_to:
+            qs = qs.filter(date__lte=date_to)
+        qs = qs.order_by("employee_id", "date", "start")
+        for _, items in groupby(qs.iterator(chunk_size=2000), key=lambda s: s.employee_id):
+            for c in self._sweep_one(items):
+                if date_from is None or c.shift.date >= date_from:
+                    yield c
+
+
 class ShiftExcelImporter:
     REQUIRED_COLS = ["date", "employee_code", "start", "end"]
 
@@ -90,29 +410,255 @@ class ShiftExcelImporter:
         if miss:
             raise ValueError(f"シフトExcelに必要な列がありません: {miss}")
 
-        created = 0
+        # 先に全行を読み込み、既存シフトと合わせて衝突チェックしてから保存する
+        emps = {}
+        rows = {}
         for _, r in df.iterrows():
-            emp = Employee.objects.filter(code=str(r["employee_code"]).strip()).first()
+            code = str(r["employee_code"]).strip()
+            if code not in emps:
+                emps[code] = Employee.objects.filter(code=code).first()
+            emp = emps[code]
             if not emp:
                 raise ValueError(f"従業員コードが存在しません: {r['employee_code']}")
             start = pd.to_datetime(r["start"]).time()
             end = pd.to_datetime(r["end"]).time()
             date = pd.to_datetime(r["date"]).date()
             break_minutes = int(r.get("break_minutes", 0) or 0)
-            Shift.objects.update_or_create(
-                employee=emp, date=date, start=start,
-                defaults={"end": end, "break_minutes": break_minutes}
+            rows[(emp.pk, date, start)] = Shift(
+                employee=emp, date=date, start=start, end=end, break_minutes=break_minutes
             )
-            created += 1
-        return {"created": created}
+
+        self.check_conflicts(list(rows.values()))
+
+        # 1行ずつ save すると行ごとに signal で DataVersion を更新し、その行のロックを取込の間ずっと持つ
+        with transaction.atomic():
+            existing = {
+                (s.employee_id, s.date, s.start): s
+                for s in Shift.objects.filter(
+                    employee_id__in={k[0] for k in rows}, date__in={k[1] for k in rows}
+                )
+            }
+            now = timezone.now()
+            to_create, to_update = [], []
+            for key, s in rows.items():
+                old = existing.get(key)
+                if old is None:
+                    to_create.append(s)
+                else:
+                    old.end, old.break_minutes = s.end, s.break_minutes
+                    old.version += 1
+                    old.updated_at = now
+                    to_update.append(old)
+            Shift.objects.bulk_create(to_create, batch_size=500)
+            Shift.objects.bulk_update(to_update, ["end", "break_minutes", "version", "updated_at"], batch_size=500)
+            if rows:
+                DataVersion.bump("shift")  # bulk_create/bulk_update は signal を送らない
+        return {"created": len(rows)}
+
+    @staticmethod
+    def check_conflicts(new_shifts):
+        if not new_shifts:
+            return
+        detector = ShiftConflictDetector()
+        lo, hi = detector.window(min(s.date for s in new_shifts), max(s.date for s in new_shifts))
+        existing = Shift.objects.select_related("employee").filter(
+            employee_id__in={s.employee_id for s in new_shifts}, date__gte=lo, date__lte=hi
+        )
+        # 同じ (従業員, 日付, 開始) の既存行は上書きされるので比較対象から外す
+        merged = {(s.employee_id, s.date, s.start): s for s in existing}
+        merged.update({(s.employee_id, s.date, s.start): s for s in new_shifts})
+        new_ids = {id(s) for s in new_shifts}
+        conflicts = [
+            c for c in detector.sweep(merged.values())
+            if id(c.shift) in new_ids or id(c.other) in new_ids
+        ]
+        if conflicts:
+            msgs = [c.message for c in conflicts[:5]]
+            if len(conflicts) > 5:
+                msgs.append(f"ほか {len(conflicts) - 5} 件")
+            raise ValueError(" / ".join(msgs))
+
+
+class ShiftBulkEditor:
+    """
+    シフトの追加・更新・削除をまとめて検証し、1トランザクションで反映する。
+    items: [{"op": "create"|"update"|"delete", "id", "version", ...フィールド}]
+    1件でもエラーがあれば何も反映しない。
+    """
+    # 1件分の検証（DBを引かない）。forms.py は services を import するので、フォームではなく Field を直接使う
+    FIELDS = {
+        "employee": forms.IntegerField(min_value=1),
+        "date": forms.DateField(),
+        "start": forms.TimeField(),
+        "end": forms.TimeField(),
+        "break_minutes": forms.IntegerField(min_value=0, max_value=32767, required=False),
+        "note": forms.CharField(max_length=255, required=False),
+    }
+    MAX_ITEMS = 500
+
+    def __init__(self, items):
+        self.items = items
+
+    def _error(self, results, i, message, code="invalid"):
+        results[i] = {"ok": False, "error": code, "message": message}
+
+    @staticmethod
+    def _is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def _clean(self, data, item):
+        """data（既存値）に item の値を重ねて検証する。(cleaned, errors) を返す"""
+        cleaned, errors = {}, {}
+        for name, field in self.FIELDS.items():
+            value = data.get(name)
+            if name in item:
+                value = item[name]
+                # JSON の数値・真偽値・配列などが Field に渡って 500 にならないよう、文字列か null に限る
+                if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+                    errors[name] = "値の形式が不正です。"
+                    continue
+                if value is not None:
+                    value = str(value)
+            try:
+                cleaned[name] = field.clean(value)
+            except ValidationError as e:
+                errors[name] = " ".join(e.messages)
+        return cleaned, errors
+
+    @transaction.atomic
+    def run(self) -> dict:
+        items = self.items
+        if not isinstance(items, list) or not items:
+            raise ValueError("items が空です。")
+        if len(items) > self.MAX_ITEMS:
+            raise ValueError(f"一度に送れるのは {self.MAX_ITEMS} 件までです。")
+
+        results = [None] * len(items)
+        ids = [it.get("id") for it in items if isinstance(it, dict) and it.get("op") in ("update", "delete")]
+        existing = Shift.objects.select_for_update().in_bulk([i for i in ids if self._is_int(i)])
+
+        creates, updates, deletes = {}, {}, {}  # 添字 -> Shift
+        touched = set()
+        for i, it in enumerate(items):
+            op = it.get("op") if isinstance(it, dict) else None
+            if op not in ("create", "update", "delete"):
+                self._error(results, i, "op は create / update / delete のいずれかです。")
+                continue
+            obj = None
+            if op != "create":
+                if not self._is_int(it.get("id")):
+                    self._error(results, i, "id は整数で指定してください。")
+                    continue
+                if not self._is_int(it.get("version")):
+                    self._error(results, i, "version は整数で指定してください。")
+                    continue
+                obj = existing.get(it["id"])
+                if obj is None:
+                    self._error(results, i, "シフトが見つかりません。", "not_found")
+                    continue
+                if obj.pk in touched:
+                    self._error(results, i, "同じシフトが複数回指定されています。")
+                    continue
+                touched.add(obj.pk)
+                if it["version"] != obj.version:
+                    self._error(results, i, "ほかの人が先に更新しました。再読み込みしてください。", "conflict")
+                    continue
+            if op == "delete":
+                deletes[i] = obj
+                continue
+
+            data = {} if obj is None else {
+                "employee": obj.employee_id, "date": obj.date, "start": obj.start,
+                "end": obj.end, "break_minutes": obj.break_minutes, "note": obj.note,
+            }
+            d, errors = self._clean(data, it)
+            if errors:
+                self._error(results, i, "; ".join(f"{k}: {v}" for k, v in errors.items()))
+                continue
+            shift = obj or Shift()
+            shift.employee_id = d["employee"]
+            shift.date, shift.start, shift.end = d["date"], d["start"], d["end"]
+            shift.break_minutes = d["break_minutes"] or 0
+            shift.note = d["note"]
+            (updates if obj else creates)[i] = shift
+
+        # 従業員の存在確認（1クエリ）
+        emp_ids = {s.employee_id for s in [*creates.values(), *updates.values()]}
+        employees = Employee.objects.in_bulk(emp_ids)
+        for bucket in (creates, updates):
+            for i, s in list(bucket.items()):
+                if s.employee_id not in employees:
+                    self._error(results, i, "従業員が存在しません。")
+                    del bucket[i]
+                else:
+                    s.employee = employees[s.employee_id]
+
+        self._check_conflicts(results, creates, updates, deletes)
+
+        if any(r is not None for r in results):
+            return self._rollback(results)
+
+        # 更新・削除は読んだときの version が変わっていない行だけに当てる。
+        # select_for_update が効かない DB（SQLite）でも、先に書いた側だけが通る
+        now = timezone.now()
+        for i, s in updates.items():
+            done = Shift.objects.filter(pk=s.pk, version=s.version).update(
+                **{k: getattr(s, k) for k in self.FIELDS}, version=s.version + 1, updated_at=now
+            )
+            if not done:
+                self._error(results, i, "ほかの人が先に更新しました。再読み込みしてください。", "conflict")
+            s.version += 1
+            s.updated_at = now
+        for i, s in deletes.items():
+            if not Shift.objects.filter(pk=s.pk, version=s.version).delete()[0]:
+                self._error(results, i, "ほかの人が先に更新しました。再読み込みしてください。", "conflict")
+        if any(r is not None for r in results):
+            return self._rollback(results)
+        Shift.objects.bulk_create(list(creates.values()))
+        if creates or updates:
+            DataVersion.bump("shift")  # bulk_create/update() は signal を送らない
+
+        for i, it in enumerate(items):
+            s = creates.get(i) or updates.get(i)
+            if s is not None:
+                results[i] = {"ok": True, "id": s.pk, "version": s.version}
+            else:
+                results[i] = {"ok": True, "id": it.get("id"), "deleted": True}
+        return {"ok": True, "results": results}
+
+    def _rollback(self, results) -> dict:
+        transaction.set_rollback(True)
+        for i, r in enumerate(results):
+            if r is None:
+                results[i] = {"ok": True, "applied": False}
+        return {"ok": False, "results": results}
+
+    def _check_conflicts(self, results, creates, updates, deletes):
+        changed = {**creates, **updates}
+        if not changed:
+            return
+        detector = ShiftConflictDetector()
+        shifts = list(changed.values())
+        lo, hi = detector.window(min(s.date for s in shifts), max(s.date for s in shifts))
+        # 変更後の状態: 既存（更新・削除分を除く）+ 更新後 + 新規
+        removed = {s.pk for s in [*updates.values(), *deletes.values()]}
+        around = Shift.objects.select_related("employee").filter(
+            employee_id__in={s.employee_id for s in shifts}, date__gte=lo, date__lte=hi
+        ).exclude(pk__in=removed)
+        index_of = {id(s): i for i, s in changed.items()}
+        for c in detector.sweep([*around, *shifts]):
+            for s in (c.shift, c.other):
+                i = index_of.get(id(s))
+                if i is not None and results[i] is None:
+                    self._error(results, i, c.message, "conflict")
 
 
 class ExcelExporter:
     @staticmethod
     def employee_template_df():
         return pd.DataFrame([
-            {"code": "E001", "name": "山田太郎", "時給": 1200},
-            {"code": "E002", "name": "佐藤花子", "時給": 1300},
+            {"code": "E001", "name": "山田太郎", "よみがな": "やまだたろう", "時給": 1200},
+            {"code": "E002", "name": "佐藤花子", "よみがな": "さとうはなこ", "時給": 1300},
         ])
 
     @staticmethod
@@ -128,6 +674,7 @@ class ExcelExporter:
             rows.append({
                 "code": e.code,
                 "name": e.name,
+                "よみがな": e.name_kana,
                 "時給": e.hourly_rate,  # 日本語列名
                 "is_active": e.is_active,
                 "created_at": timezone.localtime(e.created_at).strftime("%Y-%m-%d %H:%M:%S"),
@@ -154,7 +701,7 @@ class ExcelExporter:
         return pd.DataFrame(rows)
 
     @staticmethod
-    def df_to_xlsx_response(df, filename: str) -> HttpResponse:
+    def df_to_xlsx_bytes(df) -> bytes:
         try:
             for col in df.select_dtypes(include=["datetimetz"]).columns:   # 念のため tz-aware が紛れても外す保険
                 df[col] = df[col].dt.tz_localize(None)
@@ -164,10 +711,105 @@ class ExcelExporter:
         bio = BytesIO()
         with pd.ExcelWriter(bio, engine="openpyxl") as w:
             df.to_excel(w, index=False)
-        bio.seek(0)
-        resp = HttpResponse(
-            bio.getvalue(),
-            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        )
+        return bio.getvalue()
+
+    @staticmethod
+    def df_to_xlsx_response(df, filename: str) -> HttpResponse:
+        resp = HttpResponse(ExcelExporter.df_to_xlsx_bytes(df), content_type=XLSX_CONTENT_TYPE)
         resp["Content-Disposition"] = f'attachment; filename="{filename}"'
         return resp
+
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class ExportCache:
+    """
+    生成済み Excel をローカルディスクに保存して使い回す。
+    キーは 種類 + 絞り込み条件 + データ版数（DataVersion）なので、
+    従業員/シフトが更新されれば自動的に別ファイルになる。
+    """
+
+    def __init__(self, directory=None, max_bytes=None, max_age=None):
+        self.dir = directory or settings.EXPORT_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else settings.EXPORT_CACHE_MAX_BYTES
+        self.max_age = max_age if max_age is not None else settings.EXPORT_CACHE_MAX_AGE
+
+    def path_for(self, kind: str, params: dict, depends_on) -> "os.PathLike":
+        versions = DataVersion.current(*depends_on)
+        raw = "|".join([kind, *(f"{k}={params[k]}" for k in sorted(params)), *(f"{k}@{v}" for k, v in sorted(versions.items()))])
+        return self.dir / f"{kind}-{hashlib.sha1(raw.encode()).hexdigest()}.xlsx"
+
+    def get_or_build(self, kind: str, params: dict, depends_on, build):
+        """
+        (path, 読み取り用に開いたファイル) を返す。
+        別ワーカーの evict() で消されても、開いたハンドルからは最後まで読める。
+        """
+        path = self.path_for(kind, params, depends_on)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            f = None
+        if f is not None:
+            mtime = os.fstat(f.fileno()).st_mtime
+            if time.time() - mtime < self.max_age:
+                try:
+                    os.utime(path, (time.time(), mtime))  # atime = 最終利用
+                except FileNotFoundError:
+                    pass
+                return path, f
+            f.close()
+        data = build()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as w:
+                w.write(data)
+            f = open(tmp, "rb")
+            os.replace(tmp, path)  # 同時に生成しても壊れたファイルは見えない
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+        return path, f
+
+    # 書き込み途中の一時ファイルはこれより古ければ残骸とみなす
+    TMP_MAX_AGE = 60 * 60
+
+    def evict(self) -> None:
+        now = time.time()
+        for p in self.dir.glob("*.tmp"):
+            try:
+                if now - p.stat().st_mtime >= min(self.TMP_MAX_AGE, self.max_age):
+                    p.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+        entries = []
+        for p in self.dir.glob("*.xlsx"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime >= self.max_age:
+                p.unlink(missing_ok=True)
+            else:
+                entries.append((max(st.st_atime, st.st_mtime), st.st_size, p))
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in sorted(entries, key=lambda e: e[0]):  # 使われていない順に削除
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+
+    def response(self, request, kind: str, params: dict, depends_on, build, filename: str):
+        path, f = self.get_or_build(kind, params, depends_on, build)
+        etag = f'"{path.stem}"'
+        last_modified = int(os.fstat(f.fileno()).st_mtime)
+        resp = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if resp is None:
+            resp = FileResponse(f, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+        else:
+            f.close()
+        resp["ETag"] = etag
+        resp["Last-Modified"] = http_date(last_modified)
+        return resp
@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DataVersion, Employee, Shift
+
+
+def _bump_on_commit(key):
+    # トランザクション内で保存されても、版数の行はコミット後に短く更新する（行ロックを持ち続けない）
+    transaction.on_commit(lambda: DataVersion.bump(key))
+
+
+@receiver([post_save, post_delete], sender=Employee)
+def bump_employee_version(sender, **kwargs):
+    _bump_on_commit("employee")
+
+
+@receiver([post_save, post_delete], sender=Shift)
+def bump_shift_version(sender, **kwargs):
+    _bump_on_commit("shift")
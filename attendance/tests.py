@@ -1,3 +1,751 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time as _time
+from datetime import date, datetime, time, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.contrib import admin
+from django.db import DatabaseError, OperationalError, connection
+from django.db.models import F
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .events import PunchBroker
+from .forms import ShiftForm
+from .models import Attendance, DataVersion, Employee, PunchEvent, Shift, normalize_search
+from .services import (
+    AttendanceProjection, EmployeeCalendar, ExportCache, PunchService, ShiftBulkEditor,
+    ShiftConflictDetector, ShiftExcelImporter,
+)
+
+
+def make_shift(emp, d, start, end, **kw):
+    return Shift.objects.create(employee=emp, date=d, start=start, end=end, **kw)
+
+
+# =========================================
+# シフトの重複・休息不足
+# =========================================
+@override_settings(SHIFT_MIN_REST_MINUTES=480)
+class ShiftConflictDetectorTests(TestCase):
+    def setUp(self):
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+        self.other = Employee.objects.create(code="E002", name="佐藤花子")
+
+    def kinds(self, conflicts):
+        return sorted(c.kind for c in conflicts)
+
+    def test_overlap_same_day(self):
+        make_shift(self.emp, date(2025, 1, 1), time(9), time(13))
+        make_shift(self.emp, date(2025, 1, 1), time(12), time(18))
+        self.assertEqual(self.kinds(ShiftConflictDetector().sweep(Shift.objects.all())), ["overlap"])
+
+    def test_overnight_shift_overlaps_next_morning(self):
+        make_shift(self.emp, date(2025, 1, 1), time(22), time(6))
+        make_shift(self.emp, date(2025, 1, 2), time(5), time(9))
+        conflicts = ShiftConflictDetector().sweep(Shift.objects.all())
+        self.assertEqual(self.kinds(conflicts), ["overlap"])
+        self.assertEqual(conflicts[0].shift.date, date(2025, 1, 2))
+
+    def test_other_employee_is_not_compared(self):
+        make_shift(self.emp, date(2025, 1, 1), time(9), time(17))
+        make_shift(self.other, date(2025, 1, 1), time(9), time(17))
+        self.assertEqual(ShiftConflictDetector().sweep(Shift.objects.all()), [])
+
+    def test_rest_gap_below_minimum(self):
+        make_shift(self.emp, date(2025, 1, 1), time(17), time(23))
+        make_shift(self.emp, date(2025, 1, 2), time(6, 59), time(12))
+        conflicts = ShiftConflictDetector().sweep(Shift.objects.all())
+        self.assertEqual(self.kinds(conflicts), ["rest"])
+        self.assertEqual(conflicts[0].gap_minutes, 479)
+
+    def test_rest_gap_at_minimum_is_ok(self):
+        make_shift(self.emp, date(2025, 1, 1), time(17), time(23))
+        make_shift(self.emp, date(2025, 1, 2), time(7), time(12))
+        self.assertEqual(ShiftConflictDetector().sweep(Shift.objects.all()), [])
+
+    def test_same_day_split_shift_is_ok(self):
+        make_shift(self.emp, date(2025, 1, 1), time(10), time(14))
+        make_shift(self.emp, date(2025, 1, 1), time(17), time(22))
+        self.assertEqual(ShiftConflictDetector().sweep(Shift.objects.all()), [])
+
+    def test_rest_check_can_be_disabled(self):
+        make_shift(self.emp, date(2025, 1, 1), time(17), time(23))
+        make_shift(self.emp, date(2025, 1, 2), time(1), time(5))
+        self.assertEqual(ShiftConflictDetector(min_rest_minutes=0).sweep(Shift.objects.all()), [])
+
+    def test_audit_window_edges(self):
+        # 期間開始の前日に始まる跨日シフトとの重複は拾う
+        make_shift(self.emp, date(2025, 1, 9), time(22), time(6))
+        make_shift(self.emp, date(2025, 1, 10), time(5), time(9))
+        # 期間開始より前だけで完結する重複は出さない
+        make_shift(self.other, date(2025, 1, 5), time(9), time(13))
+        make_shift(self.other, date(2025, 1, 5), time(12), time(18))
+        # 期間終了の翌日は対象外
+        make_shift(self.other, date(2025, 1, 21), time(9), time(13))
+        make_shift(self.other, date(2025, 1, 21), time(12), time(18))
+
+        found = list(ShiftConflictDetector().audit(date(2025, 1, 10), date(2025, 1, 20)))
+        self.assertEqual([(c.kind, c.shift.date) for c in found], [("overlap", date(2025, 1, 10))])
+        self.assertEqual(len(list(ShiftConflictDetector().audit())), 3)
+
+
+@override_settings(SHIFT_MIN_REST_MINUTES=480)
+class ShiftFormConflictTests(TestCase):
+    def setUp(self):
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+        self.night = make_shift(self.emp, date(2025, 1, 1), time(22), time(6))
+
+    def form(self, instance=None, **data):
+        base = {"employee": self.emp.pk, "date": "2025-01-02", "break_minutes": 0, "note": ""}
+        return ShiftForm({**base, **data}, instance=instance)
+
+    def test_rejects_overlap_with_overnight_shift(self):
+        f = self.form(start="05:00", end="09:00")
+        self.assertFalse(f.is_valid())
+        self.assertIn("重複", f.non_field_errors()[0])
+
+    def test_rejects_short_rest(self):
+        f = self.form(start="10:00", end="15:00")
+        self.assertFalse(f.is_valid())
+        self.assertIn("休息", f.non_field_errors()[0])
+
+    def test_accepts_enough_rest(self):
+        self.assertTrue(self.form(start="14:00", end="18:00").is_valid())
+
+    def test_editing_does_not_conflict_with_itself(self):
+        f = self.form(instance=self.night, date="2025-01-01", start="21:00", end="05:00")
+        self.assertTrue(f.is_valid(), f.errors)
+
+    def test_admin_form_checks_conflicts(self):
+        from django.contrib.auth.models import User
+
+        request = RequestFactory().get("/")
+        request.user = User(is_superuser=True, is_staff=True)
+        form_class = admin.site._registry[Shift].get_form(request)
+        data = {"employee": self.emp.pk, "date": "2025-01-02", "start": "05:00", "end": "09:00",
+                "break_minutes": 0, "note": "", "version": 1}
+        f = form_class(data)
+        self.assertFalse(f.is_valid())
+        self.assertIn("重複", f.non_field_errors()[0])
+
+
+@override_settings(SHIFT_MIN_REST_MINUTES=480)
+class ShiftExcelImporterConflictTests(TestCase):
+    def setUp(self):
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+
+    def xlsx(self, rows):
+        bio = BytesIO()
+        pd.DataFrame(rows).to_excel(bio, index=False)
+        bio.seek(0)
+        return bio
+
+    def test_replacing_same_key_is_not_a_conflict(self):
+        make_shift(self.emp, date(2025, 1, 1), time(9), time(18))
+        r = ShiftExcelImporter(self.xlsx([
+            {"date": "2025-01-01", "employee_code": "E001", "start": "09:00", "end": "13:00"},
+        ])).run()
+        self.assertEqual(r, {"created": 1})
+        self.assertEqual(Shift.objects.get().end, time(13))
+
+    def test_conflict_with_existing_shift_rolls_back(self):
+        make_shift(self.emp, date(2025, 1, 1), time(9), time(18))
+        with self.assertRaisesMessage(ValueError, "重複"):
+            ShiftExcelImporter(self.xlsx([
+                {"date": "2025-01-02", "employee_code": "E001", "start": "09:00", "end": "12:00"},
+                {"date": "2025-01-01", "employee_code": "E001", "start": "17:00", "end": "20:00"},
+            ])).run()
+        self.assertEqual(Shift.objects.count(), 1)
+
+    def test_conflict_within_file(self):
+        with self.assertRaisesMessage(ValueError, "重複"):
+            ShiftExcelImporter(self.xlsx([
+                {"date": "2025-01-01", "employee_code": "E001", "start": "09:00", "end": "12:00"},
+                {"date": "2025-01-01", "employee_code": "E001", "start": "11:00", "end": "13:00"},
+            ])).run()
+        self.assertFalse(Shift.objects.exists())
+
+
+# =========================================
+# 打刻ボード (SSE)
+# =========================================
+class QuietBroker(PunchBroker):
+    def _poll_loop(self):  # テストでは DB ポーリングのスレッドを動かさない
+        pass
+
+
+class PunchBrokerTests(TestCase):
+    def event(self, pk, action="in"):
+        return {"id": pk, "action": action}
+
+    def test_publish_without_subscribers_is_not_recorded(self):
+        broker = QuietBroker(poll_seconds=1, max_clients=2)
+        broker.publish(self.event(1))
+        broker.publish(self.event(2))
+        self.assertEqual(broker._seen, {})
+
+    def test_publish_dedupes_and_fans_out(self):
+        broker = QuietBroker(poll_seconds=1, max_clients=2)
+        a, b = broker.subscribe(), broker.subscribe()
+        broker.publish(self.event(1))
+        broker.publish(self.event(1))
+        self.assertEqual((a.qsize(), b.qsize()), (1, 1))
+
+    def test_subscriber_limit(self):
+        broker = QuietBroker(poll_seconds=1, max_clients=1)
+        q = broker.subscribe()
+        self.assertIsNone(broker.subscribe())
+        self.assertFalse(broker.has_capacity())
+        broker.unsubscribe(q)
+        self.assertTrue(broker.has_capacity())
+
+    def test_poll_publishes_recent_punches_from_db(self):
+        # 別ワーカーでの打刻は DB のポーリングで拾う
+        emp = Employee.objects.create(code="E001", name="山田太郎")
+        now = timezone.now()
+        Attendance.objects.create(employee=emp, work_date=timezone.localdate(), clock_in=now)
+        old = Employee.objects.create(code="E002", name="佐藤花子")
+        Attendance.objects.create(employee=old, work_date=timezone.localdate(), clock_in=now - timedelta(hours=1))
+        broker = QuietBroker(poll_seconds=1, max_clients=2)
+        q = broker.subscribe()
+        broker.poll(now - timedelta(seconds=1))
+        broker.poll(now - timedelta(seconds=1))  # 重なった範囲を読み直しても二重に送らない
+        self.assertEqual(q.qsize(), 1)
+        ev = q.get_nowait()
+        self.assertEqual((ev["employee_code"], ev["action"]), ("E001", "in"))
+
+    def test_poll_loop_survives_errors(self):
+        broker = PunchBroker(poll_seconds=0.01, max_clients=1)
+        calls = []
+
+        def poll(since):
+            calls.append(since)
+            if len(calls) == 1:
+                raise DatabaseError("database is locked")
+
+        with mock.patch.object(broker, "poll", side_effect=poll), \
+                self.assertLogs("attendance.events", "WARNING"):
+            q = broker.subscribe()
+            deadline = _time.monotonic() + 2
+            while len(calls) < 3 and _time.monotonic() < deadline:
+                _time.sleep(0.01)
+            self.assertTrue(broker._thread.is_alive())
+            broker.unsubscribe(q)
+            broker._thread.join(timeout=2)
+        self.assertGreaterEqual(len(calls), 3)
+        self.assertEqual(calls[0], calls[1])  # 失敗した分は同じ起点から取り直す
+
+    def test_stream_returns_503_when_full(self):
+        from . import views
+
+        full = QuietBroker(poll_seconds=1, max_clients=1)
+        full.subscribe()
+        original, views.broker = views.broker, full
+        try:
+            resp = self.client.get("/punch/stream/", HTTP_HOST="localhost")
+        finally:
+            views.broker = original
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "30")
+
+
+# =========================================
+# 月間カレンダー API (ETag / 304)
+# =========================================
+class EmployeeCalendarApiTests(TestCase):
+    def setUp(self):
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+        self.today = timezone.localdate()
+        self.url = f"/api/employees/E001/calendar/{self.today.year}/{self.today.month}/"
+
+    def get(self, **headers):
+        return self.client.get(self.url, HTTP_HOST="localhost", **headers)
+
+    def etag(self):
+        resp = self.get()
+        self.assertEqual(resp.status_code, 200)
+        return resp["ETag"]
+
+    def assertEtagChanges(self, change):
+        before = self.etag()
+        change()
+        self.assertNotEqual(before, self.etag())
+
+    def test_body(self):
+        make_shift(self.emp, self.today, time(9), time(18), break_minutes=60)
+        data = self.get().json()
+        self.assertEqual(data["employee"]["code"], "E001")
+        self.assertEqual(data["shifts"][0]["work_minutes"], 480)
+        self.assertEqual(data["attendances"], [])
+
+    def test_etag_changes_on_shift_create_update_delete(self):
+        self.assertEtagChanges(lambda: make_shift(self.emp, self.today, time(9), time(12)))
+        shift = Shift.objects.get()
+
+        def update():
+            shift.note = "早番"
+            shift.save()
+        self.assertEtagChanges(update)
+        self.assertEtagChanges(shift.delete)
+
+    def test_etag_changes_on_punch(self):
+        self.assertEtagChanges(lambda: PunchService.punch(self.emp, "in"))
+        self.assertEtagChanges(lambda: PunchService.punch(self.emp, "out"))
+
+    def test_etag_changes_on_projection_rebuild(self):
+        PunchService.punch(self.emp, "in")
+        fixed = timezone.make_aware(datetime.combine(self.today, time(0, 1)))
+
+        def rebuild():
+            fix = PunchEvent.objects.create(
+                employee=self.emp, work_date=self.today, kind=PunchEvent.FIX_IN, at=fixed
+            )
+            PunchEvent.objects.create(
+                employee=self.emp, work_date=self.today, kind=PunchEvent.APPROVE, ref=fix
+            )
+            r = AttendanceProjection.rebuild(self.today, self.today)
+            self.assertEqual(r["updated"], 1)
+        self.assertEtagChanges(rebuild)
+        self.assertEqual(Attendance.objects.get().clock_in, fixed)
+
+    def test_if_none_match_returns_304_without_serializing(self):
+        make_shift(self.emp, self.today, time(9), time(12))
+        etag = self.etag()
+        with mock.patch.object(EmployeeCalendar, "as_dict") as as_dict, self.assertNumQueries(3):
+            resp = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], etag)
+        self.assertEqual(resp.content, b"")
+        as_dict.assert_not_called()
+
+    def test_stale_if_none_match_returns_body(self):
+        resp = self.get(HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(resp.status_code, 200)
+
+    def test_invalid_month(self):
+        resp = self.client.get("/api/employees/E001/calendar/2025/13/", HTTP_HOST="localhost")
+        self.assertEqual(resp.status_code, 400)
+
+
+# =========================================
+# 従業員オートコンプリート
+# =========================================
+class EmployeeSearchTests(TestCase):
+    def setUp(self):
+        Employee.objects.create(code="E001", name="山田太郎", name_kana="ヤマダ タロウ")
+        Employee.objects.create(code="E002", name="佐藤花子", name_kana="さとう はなこ")
+        Employee.objects.create(code="A100", name="比嘉", is_active=False)
+
+    def codes(self, term):
+        return sorted(Employee.objects.search(term).values_list("code", flat=True))
+
+    def test_normalize(self):
+        self.assertEqual(normalize_search(" Ｅ００１ "), "e001")
+        self.assertEqual(normalize_search("ﾔﾏﾀﾞ"), "やまだ")
+
+    def test_prefix_on_code_and_reading(self):
+        self.assertEqual(self.codes("e00"), ["E001", "E002"])
+        self.assertEqual(self.codes("ｅ001"), ["E001"])
+        self.assertEqual(self.codes("ヤマ"), ["E001"])
+        self.assertEqual(self.codes("さとう"), ["E002"])
+        self.assertEqual(self.codes("比嘉"), ["A100"])  # よみがな未登録なら氏名
+        self.assertEqual(self.codes("たろう"), [])  # 前方一致のみ
+        self.assertEqual(self.codes("  "), [])
+
+    def test_search_uses_index_on_sqlite(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite の実行計画のみ確認")
+        sql, params = Employee.objects.search("e0").query.sql_with_params()
+        with connection.cursor() as c:
+            c.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plan = " ".join(str(row[-1]) for row in c.fetchall())
+        self.assertNotIn("SCAN attendance_employee", plan)
+        self.assertIn("USING INDEX", plan)
+
+    def test_api_returns_active_only(self):
+        resp = self.client.get("/api/employees/search/?q=a1", HTTP_HOST="localhost")
+        self.assertEqual(resp.json(), {"results": []})
+        resp = self.client.get("/api/employees/search/?q=E", HTTP_HOST="localhost")
+        self.assertEqual([r["code"] for r in resp.json()["results"]], ["E001", "E002"])
+
+
+# =========================================
+# Excel エクスポートのキャッシュ
+# =========================================
+class ExportCacheTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.cache = ExportCache(directory=self.dir, max_bytes=10_000, max_age=3600)
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build_counter(self, payload=b"x"):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return payload
+        return build, calls
+
+    def get_or_build(self, *args):
+        path, f = self.cache.get_or_build(*args)
+        f.close()
+        return path
+
+    def test_hit_until_data_changes(self):
+        build, calls = self.build_counter()
+        p1 = self.get_or_build("shifts", {"date": None}, ["shift"], build)
+        p2 = self.get_or_build("shifts", {"date": None}, ["shift"], build)
+        self.assertEqual((p1, len(calls)), (p2, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            make_shift(self.emp, date(2025, 1, 1), time(9), time(12))
+        p3 = self.get_or_build("shifts", {"date": None}, ["shift"], build)
+        self.assertNotEqual(p1, p3)
+        self.assertEqual(len(calls), 2)
+
+    def test_serves_file_evicted_by_another_worker(self):
+        # 生成・確認の後で別ワーカーの evict() に消されても、開いたハンドルから返す
+        def evict_all():
+            for p in self.dir.glob("*.xlsx"):
+                p.unlink()
+
+        request = RequestFactory().get("/export/shifts.xlsx")
+        with mock.patch.object(self.cache, "evict", side_effect=evict_all):
+            resp = self.cache.response(request, "shifts", {}, ["shift"], lambda: b"PK-data", "s.xlsx")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b"".join(resp.streaming_content), b"PK-data")
+        resp.close()
+
+    def test_shift_import_bumps_version_once_after_commit(self):
+        existing = make_shift(self.emp, date(2025, 1, 1), time(9), time(12))
+        before = DataVersion.current("shift")
+        bio = BytesIO()
+        pd.DataFrame([
+            {"date": "2025-01-01", "employee_code": "E001", "start": "09:00", "end": "13:00", "break_minutes": 0},
+            {"date": "2025-01-02", "employee_code": "E001", "start": "09:00", "end": "12:00", "break_minutes": 0},
+            {"date": "2025-01-03", "employee_code": "E001", "start": "09:00", "end": "12:00", "break_minutes": 0},
+        ]).to_excel(bio, index=False)
+        bio.seek(0)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(ShiftExcelImporter(bio).run(), {"created": 3})
+        self.assertEqual(callbacks, [])  # 保存ごとの signal は出ていない
+        self.assertEqual(DataVersion.objects.get(key="shift").version, int(before["shift"].split(":")[1]) + 1)
+        existing.refresh_from_db()
+        self.assertEqual((existing.end, existing.version), (time(13), 2))
+        self.assertEqual(Shift.objects.count(), 3)
+
+    def test_key_differs_after_database_reset(self):
+        DataVersion.bump("shift")
+        before = self.cache.path_for("shifts", {}, ["shift"])
+        DataVersion.objects.all().delete()  # DB の作り直し・復元で版数が戻った状態
+        DataVersion.bump("shift")
+        self.assertNotEqual(before, self.cache.path_for("shifts", {}, ["shift"]))
+
+    def test_failed_build_leaves_no_temp_file(self):
+        def boom():
+            raise RuntimeError("build failed")
+        with self.assertRaises(RuntimeError):
+            self.get_or_build("shifts", {}, ["shift"], boom)
+        self.assertEqual(list(self.dir.glob("*")), [])
+
+    def test_evicts_old_temp_files_and_by_size(self):
+        stale = self.dir / "dead.tmp"
+        stale.write_bytes(b"x")
+        old = _time.time() - 2 * ExportCache.TMP_MAX_AGE
+        os.utime(stale, (old, old))
+        fresh = self.dir / "inflight.tmp"
+        fresh.write_bytes(b"x")
+        for i in range(3):
+            self.get_or_build("shifts", {"i": i}, ["shift"], lambda: b"x" * 4000)
+        self.assertFalse(stale.exists())
+        self.assertTrue(fresh.exists())
+        self.assertEqual(len(list(self.dir.glob("*.xlsx"))), 2)
+
+    def test_view_serves_file_with_validators(self):
+        with override_settings(EXPORT_CACHE_DIR=self.dir):
+            resp = self.client.get("/export/employees.xlsx", HTTP_HOST="localhost")
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(b"".join(resp.streaming_content).startswith(b"PK"))
+            self.assertIn("Last-Modified", resp)
+            again = self.client.get(
+                "/export/employees.xlsx", HTTP_HOST="localhost", HTTP_IF_NONE_MATCH=resp["ETag"]
+            )
+        self.assertEqual(again.status_code, 304)
+
+
+# =========================================
+# 打刻ログと Attendance（projection）
+# =========================================
+def aware(d, t):
+    return timezone.make_aware(datetime.combine(d, t))
+
+
+class AttendanceProjectionTests(TestCase):
+    def setUp(self):
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+        self.day = date(2025, 1, 10)
+
+    def event(self, kind, t=None, d=None, **kw):
+        return PunchEvent.objects.create(
+            employee=self.emp, work_date=self.day, kind=kind, at=aware(d or self.day, t) if t else None, **kw
+        )
+
+    def attendance(self):
+        att = Attendance.objects.get(employee=self.emp, work_date=self.day)
+        return att.clock_in, att.clock_out
+
+    def assertRebuildAgrees(self):
+        # 打刻・承認の時点で反映した内容と、ログから作り直した内容が一致する
+        live = self.attendance()
+        r = AttendanceProjection.rebuild(self.day, self.day)
+        self.assertEqual(r, {"created": 0, "updated": 0, "unchanged": 1})
+        self.assertEqual(self.attendance(), live)
+
+    def test_live_punch_matches_rebuild(self):
+        with mock.patch("django.utils.timezone.localdate", return_value=self.day):
+            PunchService.punch(self.emp, "in")
+            PunchService.punch(self.emp, "out")
+        clock_in, clock_out = self.attendance()
+        self.assertLess(clock_in, clock_out)
+        self.assertRebuildAgrees()
+
+    def test_duplicate_events_keep_first(self):
+        self.event(PunchEvent.IN, time(9))
+        self.event(PunchEvent.IN, time(9, 1))
+        self.event(PunchEvent.OUT, time(18))
+        self.event(PunchEvent.OUT, time(18, 1))
+        AttendanceProjection.refresh(self.emp.pk, self.day)
+        self.assertEqual(self.attendance(), (aware(self.day, time(9)), aware(self.day, time(18))))
+        self.assertRebuildAgrees()
+
+    def test_approve_applies_and_reject_does_not(self):
+        self.event(PunchEvent.IN, time(9))
+        AttendanceProjection.refresh(self.emp.pk, self.day)
+        rejected = PunchService.request_correction("E001", self.day, PunchEvent.FIX_IN, time(7))
+        PunchService.review_correction(rejected, approve=False)
+        self.assertEqual(self.attendance()[0], aware(self.day, time(9)))
+
+        approved = PunchService.request_correction("E001", self.day, PunchEvent.FIX_IN, time(8, 30))
+        PunchService.review_correction(approved, approve=True)
+        self.assertEqual(self.attendance()[0], aware(self.day, time(8, 30)))
+        self.assertRebuildAgrees()
+
+    def test_review_twice_is_rejected(self):
+        req = PunchService.request_correction("E001", self.day, PunchEvent.FIX_IN, time(9))
+        PunchService.review_correction(req, approve=True)
+        with self.assertRaisesMessage(ValueError, "処理済み"):
+            PunchService.review_correction(req, approve=False)
+        self.assertEqual(req.reviews.count(), 1)
+
+    def test_overnight_fix_out_rolls_to_next_day(self):
+        self.event(PunchEvent.IN, time(22))
+        req = PunchService.request_correction("E001", self.day, PunchEvent.FIX_OUT, time(6))
+        self.assertEqual(req.at, aware(self.day + timedelta(days=1), time(6)))
+        PunchService.review_correction(req, approve=True)
+        clock_in, clock_out = self.attendance()
+        self.assertEqual(clock_out - clock_in, timedelta(hours=8))
+        self.assertRebuildAgrees()
+
+    def test_fix_in_after_clock_out_is_rejected(self):
+        self.event(PunchEvent.IN, time(9))
+        self.event(PunchEvent.OUT, time(18))
+        with self.assertRaisesMessage(ValueError, "出勤時刻が退勤時刻より後"):
+            PunchService.request_correction("E001", self.day, PunchEvent.FIX_IN, time(19))
+
+    def test_approve_leaving_out_before_in_is_rolled_back(self):
+        # 出勤の記録より前に出された退勤の修正依頼は、そのままでは反映できない
+        req = PunchService.request_correction("E001", self.day, PunchEvent.FIX_OUT, time(8))
+        self.event(PunchEvent.IN, time(9))
+        with self.assertRaisesMessage(ValueError, "反映できません"):
+            PunchService.review_correction(req, approve=True)
+        self.assertFalse(req.reviews.exists())
+
+    def test_punch_is_recorded_even_if_projection_fails(self):
+        with mock.patch.object(AttendanceProjection, "refresh", side_effect=DatabaseError("locked")), \
+                self.assertLogs("attendance.services", "WARNING"):
+            PunchService.punch(self.emp, "in")
+        self.assertTrue(PunchEvent.objects.filter(employee=self.emp, kind=PunchEvent.IN).exists())
+        self.assertFalse(Attendance.objects.exists())
+        AttendanceProjection.rebuild(timezone.localdate(), timezone.localdate())
+        self.assertIsNotNone(Attendance.objects.get().clock_in)
+
+    def test_delete_view_keeps_punch_log(self):
+        self.event(PunchEvent.IN, time(9))
+        AttendanceProjection.refresh(self.emp.pk, self.day)
+        other = Employee.objects.create(code="E002", name="佐藤花子")
+        for emp in (self.emp, other):
+            self.client.post(f"/employees/{emp.pk}/delete/", HTTP_HOST="localhost")
+        self.emp.refresh_from_db()
+        self.assertFalse(self.emp.is_active)
+        self.assertEqual(PunchEvent.objects.filter(employee=self.emp).count(), 1)
+        self.assertTrue(Attendance.objects.filter(employee=self.emp).exists())
+        self.assertFalse(Employee.objects.filter(pk=other.pk).exists())
+
+    def test_admin_cannot_add_events(self):
+        self.assertFalse(admin.site._registry[PunchEvent].has_add_permission(None))
+
+
+# =========================================
+# シフト一括編集 API
+# =========================================
+@override_settings(SHIFT_MIN_REST_MINUTES=480)
+class ShiftBulkApiTests(TestCase):
+    def setUp(self):
+        self.emp = Employee.objects.create(code="E001", name="山田太郎")
+        self.day = date(2025, 1, 10)
+
+    def post(self, items):
+        resp = self.client.post(
+            "/api/shifts/bulk/", json.dumps({"items": items}), content_type="application/json", HTTP_HOST="localhost"
+        )
+        return resp.status_code, resp.json()
+
+    def create_item(self, d, start, end, **kw):
+        return {"op": "create", "employee": self.emp.pk, "date": d.isoformat(), "start": start, "end": end, **kw}
+
+    def test_create_update_delete(self):
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        b = make_shift(self.emp, self.day + timedelta(days=1), time(9), time(12))
+        status, body = self.post([
+            self.create_item(self.day + timedelta(days=2), "09:00", "17:00", break_minutes=60),
+            {"op": "update", "id": a.pk, "version": a.version, "end": "13:00"},
+            {"op": "delete", "id": b.pk, "version": b.version},
+        ])
+        self.assertEqual(status, 200, body)
+        a.refresh_from_db()
+        self.assertEqual(a.end, time(13))
+        self.assertEqual(body["results"][1]["version"], a.version)
+        self.assertFalse(Shift.objects.filter(pk=b.pk).exists())
+        self.assertEqual(Shift.objects.count(), 2)
+
+    def test_deletes_only(self):
+        shifts = [make_shift(self.emp, self.day + timedelta(days=n), time(9), time(12)) for n in range(3)]
+        status, body = self.post([{"op": "delete", "id": s.pk, "version": s.version} for s in shifts])
+        self.assertEqual(status, 200, body)
+        self.assertTrue(all(r["deleted"] for r in body["results"]))
+        self.assertFalse(Shift.objects.exists())
+
+    def test_one_bad_item_rolls_back_everything(self):
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        status, body = self.post([
+            self.create_item(self.day + timedelta(days=2), "09:00", "17:00"),
+            {"op": "update", "id": a.pk, "version": a.version, "end": "13:00"},
+            self.create_item(self.day + timedelta(days=3), "9時", "17:00"),
+        ])
+        self.assertEqual(status, 400)
+        self.assertEqual([r["ok"] for r in body["results"]], [True, True, False])
+        self.assertFalse(body["results"][0].get("applied", True))
+        a.refresh_from_db()
+        self.assertEqual((a.end, a.version), (time(12), 1))
+        self.assertEqual(Shift.objects.count(), 1)
+
+    def test_stale_version_is_conflict(self):
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        stale = a.version
+        a.note = "先に更新"
+        a.save()
+        status, body = self.post([{"op": "update", "id": a.pk, "version": stale, "end": "13:00"}])
+        self.assertEqual(status, 409)
+        self.assertEqual(body["results"][0]["error"], "conflict")
+        a.refresh_from_db()
+        self.assertEqual(a.end, time(12))
+
+    def test_write_after_concurrent_update_is_conflict(self):
+        # version を確認した後、書き込むまでの間に別の一括編集が先に更新した場合
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        b = make_shift(self.emp, self.day + timedelta(days=1), time(9), time(12))
+
+        def concurrent(*args):
+            Shift.objects.filter(pk__in=[a.pk, b.pk]).update(version=F("version") + 1)
+
+        with mock.patch.object(ShiftBulkEditor, "_check_conflicts", side_effect=concurrent):
+            status, body = self.post([
+                self.create_item(self.day + timedelta(days=2), "09:00", "17:00"),
+                {"op": "update", "id": a.pk, "version": a.version, "end": "13:00"},
+                {"op": "delete", "id": b.pk, "version": b.version},
+            ])
+        self.assertEqual(status, 409)
+        self.assertEqual([r.get("error") for r in body["results"]], [None, "conflict", "conflict"])
+        self.assertEqual(Shift.objects.count(), 2)
+        a.refresh_from_db()
+        self.assertEqual(a.end, time(12))
+
+    def test_database_lock_is_retryable_503(self):
+        with mock.patch.object(ShiftBulkEditor, "run", side_effect=OperationalError("database is locked")):
+            status, body = self.post([self.create_item(self.day, "09:00", "12:00")])
+        self.assertEqual(status, 503)
+        self.assertFalse(body["ok"])
+
+    def test_conflict_between_create_and_update(self):
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        status, body = self.post([
+            {"op": "update", "id": a.pk, "version": a.version, "start": "13:00", "end": "17:00"},
+            self.create_item(self.day, "16:00", "20:00"),
+        ])
+        self.assertEqual(status, 409)
+        self.assertEqual([r["error"] for r in body["results"]], ["conflict", "conflict"])
+        self.assertEqual(Shift.objects.count(), 1)
+
+    def test_moving_away_frees_the_slot(self):
+        # 更新で空いた時間帯には、同じ一括編集内で新規を入れられる
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        status, body = self.post([
+            {"op": "update", "id": a.pk, "version": a.version, "start": "13:00", "end": "17:00"},
+            self.create_item(self.day, "08:00", "12:00"),
+        ])
+        self.assertEqual(status, 200, body)
+
+    def test_malformed_values_are_per_item_400(self):
+        a = make_shift(self.emp, self.day, time(9), time(12))
+        cases = [
+            self.create_item(self.day, "09:00", "12:00", date=123),
+            self.create_item(self.day, "09:00", "12:00", employee=True),
+            self.create_item(self.day, "09:00", "12:00", note={"x": 1}),
+            {"op": "update", "id": [a.pk], "version": a.version},
+            {"op": "update", "id": True, "version": a.version},
+            {"op": "update", "id": a.pk},
+            {"op": "delete", "id": a.pk, "version": "1"},
+        ]
+        for item in cases:
+            with self.subTest(item=item):
+                status, body = self.post([item])
+                self.assertEqual(status, 400)
+                self.assertEqual(body["results"][0]["error"], "invalid")
+        self.assertTrue(Shift.objects.filter(pk=a.pk).exists())
+
+
+# =========================================
+# 負荷試験コマンド
+# =========================================
+class LoadtestPunchCommandTests(TransactionTestCase):
+    # ワーカーは別スレッド（別接続）で動くので、コミットされるテストケースで動かす
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.enterContext(override_settings(EXPORT_CACHE_DIR=tmp.name))
+
+    def run_command(self, **opts):
+        out = StringIO()
+        call_command("loadtest_punch", stdout=out, **opts)
+        return out.getvalue()
+
+    def test_smoke(self):
+        out = self.run_command(workers=2, iterations=1, background_iterations=1, interactive=False)
+        self.assertIn("punch_in", out)
+        self.assertIn("合計", out)
+        self.assertFalse(Employee.objects.filter(code__startswith="LOAD-").exists())
+
+    def test_asks_for_confirmation(self):
+        Employee.objects.create(code="LOAD-keep", name="既存")
+        with mock.patch("builtins.input", return_value="no"), self.assertRaises(CommandError):
+            self.run_command(workers=1, iterations=1)
+        self.assertTrue(Employee.objects.filter(code="LOAD-keep").exists())
@@ -1,18 +1,26 @@
+import json
+import queue
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import HttpResponse, StreamingHttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
 from django.contrib import messages
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 from datetime import datetime
-from django.db import transaction
+from django.db import OperationalError, transaction
 from django.db.models.deletion import ProtectedError
 
 from .forms import (
-    PunchForm, EmployeeForm, ShiftForm,
+    PunchForm, PunchCorrectionForm, EmployeeForm, ShiftForm,
     BulkExcelUploadForm, ShiftSearchForm
 )
-from .models import Employee, Attendance, Shift
+from .models import Employee, Attendance, Shift, PunchEvent
+from .events import broker
 from .services import (
-    PunchService, EmployeeExcelImporter, ShiftExcelImporter, ExcelExporter
+    PunchService, EmployeeExcelImporter, ShiftExcelImporter, ExcelExporter,
+    EmployeeCalendar, ExportCache, ShiftBulkEditor,
 )
 
 # トップ画面: 打刻
@@ -32,6 +40,51 @@ def punch_view(request):
     recent = Attendance.objects.select_related("employee").order_by("-work_date", "-clock_in")[:10]
     return render(request, "attendance/punch.html", {"form": f, "recent": recent, "today": timezone.localdate()})
 
+# 打刻の修正依頼（店長が管理画面で承認すると反映）
+def punch_correction_view(request):
+    if request.method == "POST":
+        f = PunchCorrectionForm(request.POST)
+        if f.is_valid():
+            d = f.cleaned_data
+            try:
+                PunchService.request_correction(d["employee_code"], d["work_date"], d["kind"], d["time"], d["note"])
+                messages.success(request, "修正依頼を送りました。店長の確認後に反映されます。")
+                return redirect("attendance:punch")
+            except ValueError as e:
+                messages.error(request, str(e))
+    else:
+        f = PunchCorrectionForm(initial={"work_date": timezone.localdate()})
+    return render(request, "attendance/punch_correction.html", {"form": f})
+
+# 打刻ボードのライブ更新 (Server-Sent Events)
+def punch_stream_view(request):
+    if not broker.has_capacity():
+        resp = HttpResponse("接続数が上限に達しています。", status=503)
+        resp["Retry-After"] = "30"
+        return resp
+
+    def stream():
+        q = broker.subscribe()
+        if q is None:  # 同時接続で上限を超えた
+            yield "retry: 30000\n\n"
+            return
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    ev = q.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"  # プロキシに切られないように
+                    continue
+                yield f"event: punch\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+        finally:
+            broker.unsubscribe(q)
+
+    resp = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
+    return resp
+
 # 従業員: 追加・一覧・削除
 def employee_list_create_view(request):
     if request.method == "POST":
@@ -48,6 +101,12 @@ def employee_list_create_view(request):
 @require_POST
 def employee_delete_view(request, pk):
     emp = get_object_or_404(Employee, pk=pk)
+    if PunchEvent.objects.filter(employee=emp).exists():
+        # 打刻ログは監査用に消さない（PROTECT）。退職者は無効化して打刻・検索の対象から外す
+        emp.is_active = False
+        emp.save(update_fields=["is_active", "updated_at"])
+        messages.warning(request, f"{emp.name} さんは打刻の記録があるため削除せず、無効にしました。")
+        return redirect("attendance:employees")
     try:
         with transaction.atomic():
             Shift.objects.filter(employee=emp).delete()
@@ -79,6 +138,29 @@ def shift_delete_view(request, pk):
     messages.success(request, "シフトを削除しました。")
     return redirect("attendance:shifts_manage")
 
+# シフト一括編集 (JSON)。全件を検証してから1トランザクションで反映
+@require_POST
+def shift_bulk_api(request):
+    try:
+        payload = json.loads(request.body or b"{}")
+        result = ShiftBulkEditor(payload.get("items") if isinstance(payload, dict) else None).run()
+    except json.JSONDecodeError:
+        return JsonResponse({"ok": False, "message": "JSON の形式が不正です。"}, status=400)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "message": str(e)}, status=400)
+    except OperationalError:
+        # SQLite で別の一括編集と書き込みがぶつかった場合など。何も反映されていないので再送してよい
+        resp = JsonResponse(
+            {"ok": False, "message": "混み合っています。しばらくしてから再送してください。"},
+            status=503, json_dumps_params={"ensure_ascii": False},
+        )
+        resp["Retry-After"] = "5"
+        return resp
+    status = 200 if result["ok"] else 409 if any(
+        r.get("error") == "conflict" for r in result["results"]
+    ) else 400
+    return JsonResponse(result, status=status, json_dumps_params={"ensure_ascii": False})
+
 # Excel一括登録（従業員 & シフト）
 def import_bulk_view(request):
     if request.method == "POST":
@@ -106,12 +188,17 @@ def import_bulk_view(request):
         f = BulkExcelUploadForm()
     return render(request, "attendance/import_bulk.html", {"form": f})
 
-# Excelエクスポート
-def export_employees_view(request):
+# Excelエクスポート（生成結果はディスクにキャッシュ）
+def _employees_xlsx():
     df = ExcelExporter.employees_df()
     if df.empty:
-        df = ExcelExporter.template_employees()
-    return ExcelExporter.df_to_xlsx_response(df, "employees.xlsx")
+        df = ExcelExporter.employee_template_df()
+    return ExcelExporter.df_to_xlsx_bytes(df)
+
+def export_employees_view(request):
+    return ExportCache().response(
+        request, "employees", {}, ["employee"], _employees_xlsx, "employees.xlsx"
+    )
 
 def export_shifts_view(request):
     date = None
@@ -120,10 +207,41 @@ def export_shifts_view(request):
             date = datetime.strptime(request.GET["date"], "%Y-%m-%d").date()
         except ValueError:
             messages.error(request, "日付の形式が不正です (YYYY-MM-DD)。")
-    df = ExcelExporter.shifts_df(date=date)
-    if df.empty:
-        df = ExcelExporter.template_shifts()
-    return ExcelExporter.df_to_xlsx_response(df, "shifts.xlsx")
+
+    def build():
+        df = ExcelExporter.shifts_df(date=date)
+        if df.empty:
+            df = ExcelExporter.shift_template_df()
+        return ExcelExporter.df_to_xlsx_bytes(df)
+
+    return ExportCache().response(
+        request, "shifts", {"date": date}, ["shift", "employee"], build, "shifts.xlsx"
+    )
+
+# 従業員ごとの月間カレンダー (JSON)。If-None-Match が一致すれば 304 で返す
+@require_GET
+def employee_calendar_api(request, code, year, month):
+    emp = get_object_or_404(Employee, code=code)
+    if not (1 <= year <= 9999 and 1 <= month <= 12):
+        return JsonResponse({"error": "年月の指定が不正です。"}, status=400)
+    cal = EmployeeCalendar(emp, year, month)
+    etag = f'"{cal.etag()}"'
+    resp = get_conditional_response(request, etag=etag)
+    if resp is None:
+        resp = JsonResponse(cal.as_dict(), json_dumps_params={"ensure_ascii": False})
+    resp["ETag"] = etag
+    resp["Cache-Control"] = "private, no-cache"
+    return resp
+
+# 従業員オートコンプリート (JSON)。コード・よみがなの前方一致
+@require_GET
+def employee_search_api(request):
+    q = request.GET.get("q", "")
+    rows = Employee.objects.filter(is_active=True).search(q).order_by("code")[:20]
+    return JsonResponse(
+        {"results": [{"id": e.pk, "code": e.code, "name": e.name, "label": e.label} for e in rows]},
+        json_dumps_params={"ensure_ascii": False},
+    )
 
 # シフト検索
 def shift_search_view(request):
@@ -100,6 +100,20 @@ AUTH_PASSWORD_VALIDATORS = [
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# シフト間の最低休息時間（分）。別の日の勤務との間隔がこれ未満ならエラー。0 で無効
+SHIFT_MIN_REST_MINUTES = int(os.getenv("SHIFT_MIN_REST_MINUTES", "480"))
+
+# 打刻ボード(SSE)が他ワーカーの打刻を拾うための DB ポーリング間隔（秒）
+PUNCH_STREAM_POLL_SECONDS = float(os.getenv("PUNCH_STREAM_POLL_SECONDS", "2"))
+# SSE は1接続で1スレッドを占有する。1プロセスあたりの接続上限で、gunicorn の --threads から
+# これを引いた数が打刻などの通常リクエスト用に残る（超えた接続は 503 + Retry-After）
+PUNCH_STREAM_MAX_CLIENTS = int(os.getenv("PUNCH_STREAM_MAX_CLIENTS", "16"))
+
+# Excel エクスポートのディスクキャッシュ（容量上限・保持期間で古いものから削除）
+EXPORT_CACHE_DIR = Path(os.getenv("EXPORT_CACHE_DIR", str(BASE_DIR / "export_cache")))
+EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+EXPORT_CACHE_MAX_AGE = int(os.getenv("EXPORT_CACHE_MAX_AGE", str(24 * 60 * 60)))  # 秒
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,